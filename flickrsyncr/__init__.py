@@ -5,6 +5,7 @@ from .config import Config, loadConfigStore
 from .flickrwrapper import getFlickrAPI
 from .general import CHECKSUM_TAG_PREFIX, SyncError, VERSION
 from .syncer import sync
+from .watcher import watch
 from .status import setupStatus, updateStatus
 from .__main__ import cli
 
@@ -14,6 +15,7 @@ between a local directory and a Flickr album.
 
 * flickrsyncr.Config - a class for specifying configuration settings.
 * flickrsyncr.sync - a function that to perform sync logic per config.
+* flickrsyncr.watch - a function that pushes files as they change, until interrupted.
 * flickrsyncr.SyncError - the exception raised on fatal errors.
 
 ex: Force the Flickr album contents to match local dir based only on file name.
@@ -6,6 +6,12 @@ import sys
 
 import flickrapi
 from .config import Config
+from .config import DEFAULT_API_BURST
+from .config import DEFAULT_API_CALLS_PER_HOUR
+from .config import DEFAULT_HTTP_TIMEOUT
+from .config import DEFAULT_RETRIES
+from .config import DEFAULT_WATCH_RECONCILE
+from .config import DEFAULT_WATCH_SETTLE
 from .config import loadConfigStore
 from .flickrwrapper import getFlickrAPI
 from .general import CHECKSUM_TAG_PREFIX
@@ -14,6 +20,7 @@ from .general import VERSION
 from .status import setupStatus
 from .status import updateStatus
 from .syncer import sync
+from .watcher import watch
 
 
 def getCmdlineArgs():
@@ -26,11 +33,36 @@ def getCmdlineArgs():
     parser.add_argument('--album', required=True, type=str,
             help='Name of the Flickr album. If there are multiple albums with the same name, ' +
             'the first one (per ordering in the user\'s account) will be used. If no album ' +
-            'has this name during a --push, it will be created.')
+            'has this name during a --push, it will be created. With --tree, a template for ' +
+            'album names.')
 
     parser.add_argument('--path', required=True, type=str,
             help='Local path to use in the sync process. It must exist.')
 
+    parser.add_argument('--adaptive_workers', action='store_true',
+            help='Start with one transfer at a time and adapt the number of parallel ' +
+            'transfers to how Flickr responds: add one while transfers are fast and succeed, ' +
+            'halve on timeouts and throttling. --upload_workers and --download_workers are ' +
+            'the maximum.')
+
+    parser.add_argument('--album_batch', default=0, type=int,
+            help='With --push, hand uploaded photos this many at a time to separate threads ' +
+            'that add them to the album, so uploads don\'t wait on it. Each photo still takes ' +
+            'one API call. 0 adds each photo as it\'s uploaded.')
+
+    parser.add_argument('--album_workers', default=1, type=int,
+            help='Number of albums to sync in parallel with --tree. They share the API rate ' +
+            'limit and bandwidth limits.')
+
+    parser.add_argument('--api_burst', default=DEFAULT_API_BURST, type=int,
+            help='Number of Flickr API calls that may be made in a burst before ' +
+            '--api_calls_per_hour paces them.')
+
+    parser.add_argument('--api_calls_per_hour', default=DEFAULT_API_CALLS_PER_HOUR, type=int,
+            help='Average number of Flickr API calls allowed per hour. Calls are paced to ' +
+            'stay under Flickr\'s per-key quota instead of being throttled by Flickr. 0 ' +
+            'disables the limit.')
+
     parser.add_argument('--api_key', default='', required=False, type=str,
             help='Flickr API Key associated with the account. Can alternatively be provided ' +
             'via the config file.')
@@ -39,6 +71,16 @@ def getCmdlineArgs():
             help='Flickr API Secret associated with the account. Can alternatively be provided ' +
             'via the config file.')
 
+    parser.add_argument('--async_uploads', action='store_true',
+            help='With --push, don\'t wait for Flickr to process each upload. Uploads return ' +
+            'a ticket right away and the tickets are checked in batches afterwards, which ' +
+            'hides Flickr\'s processing time of large files.')
+
+    parser.add_argument('--backfill_checksums', action='store_true',
+            help='With --checksum, Flickr photos that have no checksum tag (eg. uploaded ' +
+            'without --checksum) are assumed to match the local file with the same name and ' +
+            'are tagged with its checksum, instead of being transferred again.')
+
     parser.add_argument('--checksum', action='store_true',
             help='Use checksums comparing local and Flickr content. Stores the checksum on ' +
             'a photo tag with prefix "' + CHECKSUM_TAG_PREFIX + '"". Allows ' +
@@ -46,16 +88,52 @@ def getCmdlineArgs():
             'title are used to compare files. Checksums are calculated at upload time, they ' +
             'are not updated if the photo is manually edited.')
 
+    parser.add_argument('--checksum_workers', default=1, type=int,
+            help='Number of files to checksum in parallel with --checksum. Raise it for SSDs ' +
+            'and RAID arrays, leave it at 1 for a single spinning disk.')
+
     parser.add_argument('--config_dir', default='', type=str,
             help='Directory with the config file (with api_key and api_secret) and OAuth store.')
 
     parser.add_argument('--config_profile', default='', type=str,
             help='Profile name inside the config file to use.')
 
+    parser.add_argument('--dedupe', action='store_true',
+            help='With --push and --checksum, a file whose checksum matches a photo anywhere ' +
+            'in the Flickr account is not uploaded again, the existing photo is added to the ' +
+            'album instead.')
+
+    parser.add_argument('--download_limit', default=0, type=float,
+            help='Maximum download bandwidth in KiB/s, shared by all --download_workers. 0 ' +
+            'for no limit.')
+
+    parser.add_argument('--download_workers', default=1, type=int,
+            help='Number of photos to download in parallel with --pull.')
+
     parser.add_argument('--dryrun', action='store_true',
             help='Make no file or photo changes. Output & logs show what would have happened. ' +
             'Still obtains and stores OAuth credentials.')
 
+    parser.add_argument('--exclude', action='append', type=str,
+            help='Glob pattern, eg. "*.tmp", of file names to leave out of the sync. May be ' +
+            'given more than once. Flickr photos with matching titles are left alone too.')
+
+    parser.add_argument('--extensions', type=lambda s: [e for e in s.split(',') if e],
+            help='Comma-separated file extensions, eg. "jpg,png", to limit the sync to. ' +
+            'Case-insensitive.')
+
+    parser.add_argument('--fsync', action='store_true',
+            help='Flush each downloaded file to disk before moving it into place. Slower, but ' +
+            'a power loss can\'t leave a downloaded file empty.')
+
+    parser.add_argument('--http_timeout', default=DEFAULT_HTTP_TIMEOUT, type=float,
+            help='Seconds to wait for Flickr to connect or send data before a request fails. ' +
+            'Timeouts are retried like other network errors.')
+
+    parser.add_argument('--include', action='append', type=str,
+            help='Glob pattern, eg. "IMG_*", of file names to limit the sync to. May be given ' +
+            'more than once, a file is synced if it matches any of them.')
+
     parser.add_argument('--loglevel', action='store', choices=['NOTSET', 'DEBUG', 'INFO',
             'WARNING', 'ERROR'], default='INFO',
             help='Verbosity for log output to --logfile. NOTSET produces no logs.')
@@ -71,6 +149,23 @@ def getCmdlineArgs():
             '(Careful: when used with --checksum, if checksums are not on Flickr then all local ' +
             'content will be overwridden.)')
 
+    parser.add_argument('--refresh', action='store_true',
+            help='List the Flickr album in full. By default the album listing is cached in ' +
+            'the config dir and, if the album\'s membership hasn\'t changed, only photos ' +
+            'updated since the last run are fetched. Likewise for the account\'s checksum ' +
+            'index used by --dedupe.')
+
+    parser.add_argument('--resume', action='store_true',
+            help='Continue a sync that was interrupted (crash, reboot, Ctrl-C) from its ' +
+            'journal in the config dir, skipping the listing, checksums, and operations that ' +
+            'already completed. Must use the same settings as the interrupted sync. If there ' +
+            'is no interrupted sync, a normal sync is done.')
+
+    parser.add_argument('--retries', default=DEFAULT_RETRIES, type=int,
+            help='Times to retry a photo\'s upload, download, or deletion after a network ' +
+            'error, timeout, or Flickr server error, with exponential backoff. Photos that ' +
+            'still fail are reported at the end.')
+
     parser.add_argument('--sync', action='store_true',
             help='Synchronize the destination to match the source. After completing a --push or '
                 '--pull, remove photos in destination that are not in the source.')
@@ -82,8 +177,36 @@ def getCmdlineArgs():
             '(Caution: this could completely change Flickr photos noticed by the app. This not ' +
             'a way to apply the tag to existing photos.)')
 
+    parser.add_argument('--tree', action='store_true',
+            help='Sync each directory under --path, recursively, with its own album. --album ' +
+            'is then the album name template, where "{dir}" is replaced by the directory\'s ' +
+            'path relative to --path, eg. --album "Trips: {dir}". Hidden directories are ' +
+            'skipped. With --pull, albums matching the template get a directory created.')
+
+    parser.add_argument('--upload_limit', default=0, type=float,
+            help='Maximum upload bandwidth in KiB/s, shared by all --upload_workers. 0 for no ' +
+            'limit.')
+
+    parser.add_argument('--upload_workers', default=1, type=int,
+            help='Number of files to upload in parallel with --push. If the album doesn\'t ' +
+            'exist yet, the first photo is uploaded alone so the album is only created once.')
+
     parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
 
+    parser.add_argument('--watch', action='store_true',
+            help='With --push, keep running after the sync and upload files as they\'re ' +
+            'added or changed, without listing the album again. Uses inotify if the ' +
+            'inotify_simple package is installed, otherwise polls the directory. Stop with ' +
+            'Ctrl-C.')
+
+    parser.add_argument('--watch_reconcile', default=DEFAULT_WATCH_RECONCILE, type=float,
+            help='Seconds between full syncs with --watch, which catch anything the watch ' +
+            'missed, eg. deleted files with --sync. 0 for none after the first.')
+
+    parser.add_argument('--watch_settle', default=DEFAULT_WATCH_SETTLE, type=float,
+            help='Seconds a file must go unmodified before --watch uploads it, so files ' +
+            'that are still being written aren\'t uploaded half-way.')
+
     return parser.parse_args()
 
 
@@ -120,6 +243,31 @@ def cli():
             sync=args.sync,
             tag=args.tag,
             checksum=args.checksum,
+            backfill_checksums=args.backfill_checksums,
+            dedupe=args.dedupe,
+            album_batch=args.album_batch,
+            async_uploads=args.async_uploads,
+            http_timeout=args.http_timeout,
+            upload_limit=args.upload_limit,
+            download_limit=args.download_limit,
+            adaptive_workers=args.adaptive_workers,
+            include=args.include,
+            exclude=args.exclude,
+            extensions=args.extensions,
+            tree=args.tree,
+            album_workers=args.album_workers,
+            watch=args.watch,
+            watch_settle=args.watch_settle,
+            watch_reconcile=args.watch_reconcile,
+            checksum_workers=args.checksum_workers,
+            upload_workers=args.upload_workers,
+            download_workers=args.download_workers,
+            fsync=args.fsync,
+            refresh=args.refresh,
+            api_calls_per_hour=args.api_calls_per_hour,
+            api_burst=args.api_burst,
+            retries=args.retries,
+            resume=args.resume,
             dryrun=args.dryrun,
             dir_=args.config_dir,
             store=loadConfigStore(config_dir=args.config_dir),
@@ -127,8 +275,13 @@ def cli():
 
         # Do the actual syncing.
         flickrwrapper = getFlickrAPI(config)
-        config.album_id = flickrwrapper.getAlbumID(args.album)
-        sync(config, flickrwrapper)
+        # In tree mode each directory's album is found by sync().
+        if not config.tree:
+            config.album_id = flickrwrapper.getAlbumID(args.album)
+        if config.watch:
+            watch(config, flickrwrapper)
+        else:
+            sync(config, flickrwrapper)
     except (SyncError) as e:
         print(e, file=sys.stderr)
         logger.error(e)
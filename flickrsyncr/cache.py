@@ -0,0 +1,214 @@
+"""Caches persisted in the config dir, used to avoid repeating expensive work between runs."""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .general import CHECKSUM_TAG_PREFIX
+
+__all__ = ['ChecksumIndex', 'LocalCache', 'RemoteCatalog']
+logger = logging.getLogger(__name__)
+
+
+LOCAL_CACHE_PREFIX = 'localcache-'
+REMOTE_CATALOG_PREFIX = 'catalog-'
+CHECKSUM_INDEX_FILENAME = 'checksums.json'
+
+# Photos updated since the last listing are re-fetched from this long before it, so clock skew
+# between here and Flickr can't hide an update. Re-fetching a few photos twice is cheap.
+CATALOG_WATERMARK_SLACK = 3600
+
+# The listing fields that photos.recentlyUpdated() refreshes in the catalog.
+CATALOG_UPDATED_FIELDS = ['title', 'tags', 'machine_tags', 'url_o']
+
+
+def fileIdentity(st):
+	"""Returns the parts of a stat result that change when a file's content is replaced or
+	modified. Cached values are only trusted while these are unchanged.
+	"""
+	return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def loadJSON(filename, default):
+	"""Reads a JSON file. Returns default if it doesn't exist or can't be parsed, a cache is
+	never worth failing a sync over.
+	"""
+	try:
+		with open(filename, 'r') as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return default
+	except (OSError, ValueError) as e:
+		logger.warning('Ignoring unreadable cache file "{}": {}'.format(filename, e))
+		return default
+
+
+def saveJSON(filename, data):
+	"""Writes a JSON file atomically, so a crash never leaves a half-written file behind.
+	"""
+	try:
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		# Albums synced in parallel in tree mode share the account-wide files.
+		tmp_filename = '{}.{}.tmp'.format(filename, threading.get_ident())
+		with open(tmp_filename, 'w') as f:
+			json.dump(data, f)
+		os.replace(tmp_filename, filename)
+	except OSError as e:
+		logger.warning('Could not write cache file "{}": {}'.format(filename, e))
+
+
+class LocalCache():
+	"""Values derived from the content of files in one local directory, eg. checksums. Entries
+	are keyed on the file name and are invalidated when the file's size, mtime, or inode change.
+	Each local directory gets its own cache file in the config dir.
+	"""
+	def __init__(self, config_dir, path):
+		path_hash = hashlib.md5(os.path.abspath(path).encode('utf-8')).hexdigest()
+		self.filename = os.path.join(config_dir, LOCAL_CACHE_PREFIX + path_hash + '.json')
+		self.lock = threading.Lock()
+		self.entries = loadJSON(self.filename, {})
+		self.dirty = False
+		logger.debug('Loaded {} local cache entries from "{}"'.format(len(self.entries),
+				self.filename))
+
+	def get(self, name, st, field):
+		"""Returns the cached value of field for the file, or None if it isn't cached or the file
+		has changed since it was cached.
+		"""
+		with self.lock:
+			entry = self.entries.get(name)
+			if not entry or entry['id'] != fileIdentity(st):
+				return None
+			return entry.get(field)
+
+	def put(self, name, st, field, value):
+		"""Caches the value of field for the file as of the stat result st.
+		"""
+		identity = fileIdentity(st)
+		with self.lock:
+			entry = self.entries.get(name)
+			# The file changed, everything previously cached about it is stale.
+			if not entry or entry['id'] != identity:
+				entry = {'id': identity}
+				self.entries[name] = entry
+			entry[field] = value
+			self.dirty = True
+
+	def rename(self, old_name, new_name):
+		"""Moves the entry of a renamed file. Renaming keeps the file's identity, so its cached
+		values stay valid.
+		"""
+		with self.lock:
+			entry = self.entries.pop(old_name, None)
+			if entry:
+				self.entries[new_name] = entry
+				self.dirty = True
+
+	def prune(self, names):
+		"""Drops entries for files that are not in names, ie. files that no longer exist.
+		"""
+		names = set(names)
+		with self.lock:
+			vanished = [n for n in self.entries if n not in names]
+			for n in vanished:
+				del self.entries[n]
+			if vanished:
+				logger.debug('Pruned {} vanished files from the local cache'.format(len(vanished)))
+				self.dirty = True
+
+	def save(self):
+		"""Persists the cache if it changed.
+		"""
+		with self.lock:
+			if not self.dirty:
+				return
+			saveJSON(self.filename, self.entries)
+			self.dirty = False
+
+
+class RemoteCatalog():
+	"""The listing of a Flickr album, persisted so later runs only fetch what changed.
+
+	The album's membership is tracked by its update date and photo and video counts. If any of
+	them changed the album is listed in full. Otherwise only photos updated since the last
+	listing are fetched, and their titles and tags are refreshed in the cached listing.
+	"""
+	def __init__(self, config_dir, album_id):
+		self.album_id = album_id
+		self.filename = os.path.join(config_dir, REMOTE_CATALOG_PREFIX + str(album_id) + '.json')
+		self.data = loadJSON(self.filename, {})
+
+	def list(self, flickrwrapper, refresh=False):
+		"""Returns the album listing, in the format of FlickrWrapper.listAlbum(). Lists the album
+		in full if refresh is set.
+		"""
+		listed_at = int(time.time())
+		info = flickrwrapper.getAlbumInfo(self.album_id)
+		membership = [info['date_update'], info['photos'], info['videos']]
+
+		if refresh or not self.data or self.data['membership'] != membership:
+			logger.info('Listing album {} in full'.format(self.album_id))
+			photos = flickrwrapper.listAlbum(self.album_id)
+		else:
+			updated = flickrwrapper.listRecentlyUpdated(self.data['watermark'])
+			logger.info('Album {} membership unchanged, refreshing {} recently updated photos'
+					.format(self.album_id, len(updated)))
+			updated = {p['id'] : p for p in updated}
+			photos = self.data['photos']
+			for p in photos:
+				if p['id'] in updated:
+					for field in CATALOG_UPDATED_FIELDS:
+						if field in updated[p['id']]:
+							p[field] = updated[p['id']][field]
+
+		self.data = {
+			'membership': membership,
+			'watermark': listed_at - CATALOG_WATERMARK_SLACK,
+			'photos': photos,
+		}
+		saveJSON(self.filename, self.data)
+		return photos
+
+
+class ChecksumIndex():
+	"""The checksums of all the photos in the Flickr account, from their checksum tags,
+	persisted so later runs only fetch what changed.
+
+	The first run searches the account for photos with a checksum tag. Later runs only fetch
+	photos updated since the last run, which includes new uploads and retagged photos. Deleted
+	photos aren't noticed, so the index may refer to photos that no longer exist.
+	"""
+	def __init__(self, config_dir):
+		self.filename = os.path.join(config_dir, CHECKSUM_INDEX_FILENAME)
+		self.data = loadJSON(self.filename, {})
+
+	def load(self, flickrwrapper, refresh=False):
+		"""Returns a dict of checksum->photo id. Searches the account in full if refresh is set.
+		"""
+		listed_at = int(time.time())
+		if refresh or not self.data:
+			logger.info('Indexing the checksums of all photos in the account')
+			photo_checksums = {}
+			photos = flickrwrapper.listChecksummed()
+		else:
+			photo_checksums = self.data['photos']
+			photos = flickrwrapper.listRecentlyUpdated(self.data['watermark'])
+			logger.info('Refreshing the checksums of {} recently updated photos'.format(
+					len(photos)))
+
+		for p in photos:
+			checksums = [t[len(CHECKSUM_TAG_PREFIX):] for t in p.get('machine_tags', '').split()
+					if t.startswith(CHECKSUM_TAG_PREFIX)]
+			if checksums:
+				photo_checksums[p['id']] = checksums[0]
+			else:
+				photo_checksums.pop(p['id'], None)
+
+		self.data = {
+			'watermark': listed_at - CATALOG_WATERMARK_SLACK,
+			'photos': photo_checksums,
+		}
+		saveJSON(self.filename, self.data)
+		return {checksum : photo_id for photo_id, checksum in photo_checksums.items()}
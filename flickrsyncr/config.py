@@ -6,10 +6,21 @@ import os
 from .general import CHECKSUM_TAG_PREFIX
 from .general import CHECKSUM_TAG_PREFIX_NORMALIZED
 from .general import SyncError
+from .tree import TREE_DIR_PLACEHOLDER
 
 DEFAULT_CONFIG_DIR = '~/.config/flickrsyncr'
 DEFAULT_SECTION_NAME = 'DEFAULT'
 CONFIG_FILENAME = 'config'
+# Flickr allows 3600 API calls per hour per API key.
+DEFAULT_API_CALLS_PER_HOUR = 3600
+DEFAULT_API_BURST = 100
+DEFAULT_RETRIES = 3
+# Seconds to wait for Flickr to connect or send data before giving up on a request.
+DEFAULT_HTTP_TIMEOUT = 60
+# In watch mode, seconds a file must go unmodified before it's pushed, and seconds between full
+# syncs.
+DEFAULT_WATCH_SETTLE = 5
+DEFAULT_WATCH_RECONCILE = 3600
 
 
 __all__ = ['Config', 'loadConfigStore']
@@ -32,9 +43,59 @@ class Config():
         checksum: Store the file's checksum on Flickr, use it to detect edits. (Optional)
         dryrun: Don't make any modifications to photos, locally or on Flickr. (Optional)
         store: Supports .get(setting_name) for reading config values.
+        checksum_workers: Number of files to checksum in parallel. (Optional)
+        upload_workers: Number of files to upload in parallel. (Optional)
+        download_workers: Number of photos to download in parallel. (Optional)
+        fsync: Flush each download to disk before moving it into place. (Optional)
+        refresh: List the Flickr album, and the account's checksums for dedupe, in full
+            instead of only fetching changes. (Optional)
+        api_calls_per_hour: Flickr API calls allowed per hour on average, 0 for no limit.
+            (Optional)
+        api_burst: Flickr API calls allowed in a burst before api_calls_per_hour applies.
+            (Optional)
+        retries: Times to retry a photo's transfer or deletion after a network or server
+            error. (Optional)
+        resume: Continue an interrupted sync from its journal instead of starting over.
+            (Optional)
+        backfill_checksums: Tag Flickr photos that have no checksum with their local file's
+            checksum instead of transferring them. Requires checksum. (Optional)
+        dedupe: Add photos already in the Flickr account to the album instead of uploading
+            files with the same checksum again. Requires checksum. (Optional)
+        async_uploads: Don't wait for Flickr to process each upload, check on them in batches
+            afterwards. (Optional)
+        http_timeout: Seconds to wait for Flickr to connect or send data before a request
+            fails. (Optional)
+        upload_limit: Upload bandwidth shared by all uploads, in KiB/s, 0 for no limit.
+            (Optional)
+        download_limit: Download bandwidth shared by all downloads, in KiB/s, 0 for no limit.
+            (Optional)
+        adaptive_workers: Adapt the number of parallel transfers to how Flickr responds, up to
+            upload_workers and download_workers. (Optional)
+        include: Glob patterns, only files whose names match one of them are synced.
+            (Optional)
+        exclude: Glob patterns, files whose names match any of them aren't synced. (Optional)
+        extensions: File extensions, eg. "jpg", only files with one of them are synced.
+            (Optional)
+        tree: Sync each directory under path with its own album. album is then a template for
+            the album names, where "{dir}" is the directory's path relative to path. (Optional)
+        album_workers: Number of albums to sync in parallel in tree mode. (Optional)
+        watch: Keep running, push files as they're added or changed. Requires push. (Optional)
+        watch_settle: Seconds a file must go unmodified before watch pushes it. (Optional)
+        watch_reconcile: Seconds between full syncs in watch mode, 0 for none after the
+            first. (Optional)
+        album_batch: Add uploaded photos to the album this many at a time, 0 to add each one
+            as it's uploaded. (Optional)
     """
     def __init__(self, album, path, dir_='', api_key=None, api_secret=None, push=False,
-            pull=False, sync=False, tag=None, checksum=False, dryrun=False, store=None):
+            pull=False, sync=False, tag=None, checksum=False, dryrun=False, store=None,
+            checksum_workers=1, upload_workers=1, download_workers=1, fsync=False,
+            refresh=False, api_calls_per_hour=DEFAULT_API_CALLS_PER_HOUR,
+            api_burst=DEFAULT_API_BURST, retries=DEFAULT_RETRIES, resume=False,
+            backfill_checksums=False, dedupe=False, album_batch=0, async_uploads=False,
+            http_timeout=DEFAULT_HTTP_TIMEOUT, upload_limit=0, download_limit=0,
+            adaptive_workers=False, include=None, exclude=None, extensions=None, tree=False,
+            album_workers=1, watch=False, watch_settle=DEFAULT_WATCH_SETTLE,
+            watch_reconcile=DEFAULT_WATCH_RECONCILE):
         # User-provided Config.
         self.album = album
         self.path = path
@@ -47,6 +108,31 @@ class Config():
         self.dryrun = dryrun
         self.api_key = api_key
         self.api_secret = api_secret
+        self.checksum_workers = checksum_workers
+        self.upload_workers = upload_workers
+        self.download_workers = download_workers
+        self.fsync = fsync
+        self.refresh = refresh
+        self.api_calls_per_hour = api_calls_per_hour
+        self.api_burst = api_burst
+        self.retries = retries
+        self.resume = resume
+        self.backfill_checksums = backfill_checksums
+        self.dedupe = dedupe
+        self.album_batch = album_batch
+        self.async_uploads = async_uploads
+        self.http_timeout = http_timeout
+        self.upload_limit = upload_limit
+        self.download_limit = download_limit
+        self.adaptive_workers = adaptive_workers
+        self.include = include
+        self.exclude = exclude
+        self.extensions = extensions
+        self.tree = tree
+        self.album_workers = album_workers
+        self.watch = watch
+        self.watch_settle = watch_settle
+        self.watch_reconcile = watch_reconcile
 
         # Config that are populated later.
         self.album_id = None
@@ -123,6 +209,12 @@ class Config():
                     'What was set: push={}, pull={}, checksum={}'.format(
                     self.push, self.pull, self.checksum))
 
+        if self.backfill_checksums and not self.checksum:
+            raise SyncError('--backfill_checksums only makes sense with --checksum.')
+
+        if self.dedupe and not self.checksum:
+            raise SyncError('--dedupe only makes sense with --checksum.')
+
         # Don't let the custom tag start with the checksum tag's prefix, it will confuse checksum
         # syncing logic.
         if self.tag and (self.tag.startswith(CHECKSUM_TAG_PREFIX) or self.tag.startswith(
@@ -135,6 +227,49 @@ class Config():
         if self.tag and ' ' in self.tag:
             raise SyncError('Do not put spaces in tags.')
 
+        if self.checksum_workers < 1:
+            raise SyncError('checksum_workers must be at least 1, got {}.'.format(
+                    self.checksum_workers))
+        if self.upload_workers < 1:
+            raise SyncError('upload_workers must be at least 1, got {}.'.format(
+                    self.upload_workers))
+        if self.download_workers < 1:
+            raise SyncError('download_workers must be at least 1, got {}.'.format(
+                    self.download_workers))
+        if self.api_calls_per_hour < 0:
+            raise SyncError('api_calls_per_hour must not be negative, got {}.'.format(
+                    self.api_calls_per_hour))
+        if self.api_burst < 1:
+            raise SyncError('api_burst must be at least 1, got {}.'.format(self.api_burst))
+        if self.retries < 0:
+            raise SyncError('retries must not be negative, got {}.'.format(self.retries))
+        if self.http_timeout <= 0:
+            raise SyncError('http_timeout must be positive, got {}.'.format(self.http_timeout))
+        if self.upload_limit < 0:
+            raise SyncError('upload_limit must not be negative, got {}.'.format(
+                    self.upload_limit))
+        if self.download_limit < 0:
+            raise SyncError('download_limit must not be negative, got {}.'.format(
+                    self.download_limit))
+        if self.tree and self.album.count(TREE_DIR_PLACEHOLDER) != 1:
+            raise SyncError('With --tree, the album name must contain "{}" exactly once, it\'s '
+                    .format(TREE_DIR_PLACEHOLDER) + 'replaced by each directory\'s path.')
+        if self.watch and (not self.push or self.pull or self.tree):
+            raise SyncError('--watch only pushes, use it with --push and without --pull or ' +
+                    '--tree.')
+        if self.watch_settle < 0:
+            raise SyncError('watch_settle must not be negative, got {}.'.format(
+                    self.watch_settle))
+        if self.watch_reconcile < 0:
+            raise SyncError('watch_reconcile must not be negative, got {}.'.format(
+                    self.watch_reconcile))
+        if self.album_workers < 1:
+            raise SyncError('album_workers must be at least 1, got {}.'.format(
+                    self.album_workers))
+        if self.album_batch < 0:
+            raise SyncError('album_batch must not be negative, got {}.'.format(
+                    self.album_batch))
+
 
 def loadConfigStore(config_dir=''):
     """Provides a reader for config file. If config_dir is empty, uses a default."""
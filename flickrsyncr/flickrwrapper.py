@@ -1,17 +1,85 @@
 """Wrapper for the Flickr API."""
+import collections
+import concurrent.futures
+import functools
 import logging
-import urllib
+import os
+import re
+import socket
+import threading
+import time
+import urllib.error
+import uuid
 
 import flickrapi
+import requests
 
+from .config import DEFAULT_HTTP_TIMEOUT
+from .general import CHECKSUM_TAG_PREFIX
+from .general import PARTIAL_DOWNLOAD_PREFIX
 from .general import SyncError
 from .status import updateStatus
+from .throttle import ThrottledReader
+from .throttle import TokenBucket
 
 
-__all__ = ['getFlickrAPI', 'FlickrWrapper']
+__all__ = ['getFlickrAPI', 'FlickrWrapper', 'isTransientError']
 logger = logging.getLogger(__name__)
 
 
+# Downloads are streamed to disk in chunks of this size, it caps the memory used per download.
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+# Listings use Flickr's maximum page size. After the first page reveals the page count, the
+# remaining pages are fetched with this many concurrent requests.
+LIST_PAGE_SIZE = 500
+LIST_PAGE_WORKERS = 8
+# Photo fields requested in listings. "tags" are normalized (eg. "checksummd5abc"), while
+# "machine_tags" are as set (eg. "checksum:md5=abc"). "url_o" is the original's download URL,
+# saving a getSizes() call per download.
+LIST_EXTRAS = 'tags,machine_tags,url_o'
+
+# Flickr only returns this many results of a search, however many pages there are. Larger
+# searches are split by upload date.
+SEARCH_RESULT_LIMIT = 4000
+
+# Asynchronous uploads are checked on this many tickets per call.
+TICKET_CHECK_BATCH = 100
+
+# Flickr API error codes that may succeed if retried: "Service currently unavailable" and "Write
+# operation failed".
+TRANSIENT_FLICKR_CODES = {105, 106}
+# HTTP statuses that may succeed if retried: rate limiting and server errors.
+TRANSIENT_HTTP_STATUSES = {429, 500, 502, 503, 504}
+
+
+def isTransientError(err):
+	"""Returns whether the exception err is a network or server failure that may succeed if the
+	operation is retried.
+	"""
+	if isinstance(err, urllib.error.HTTPError):
+		return err.code in TRANSIENT_HTTP_STATUSES
+	if isinstance(err, requests.exceptions.HTTPError):
+		return err.response is not None and err.response.status_code in TRANSIENT_HTTP_STATUSES
+	if isinstance(err, flickrapi.exceptions.FlickrError):
+		if err.code in TRANSIENT_FLICKR_CODES:
+			return True
+		# flickrapi reports HTTP failures as a FlickrError without a code.
+		status = re.search(r'Status code (\d+)', str(err))
+		return bool(status) and int(status.group(1)) in TRANSIENT_HTTP_STATUSES
+	return isinstance(err, (urllib.error.URLError, requests.exceptions.ConnectionError,
+			requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError,
+			ConnectionError, TimeoutError, socket.timeout))
+
+
+def isServiceError(err):
+	"""Returns whether the exception err is a failure reported by Flickr or the network, which
+	only fails the operation it happened in, as opposed to a bug.
+	"""
+	return isTransientError(err) or isinstance(err, (flickrapi.exceptions.FlickrError,
+			requests.exceptions.RequestException, urllib.error.URLError))
+
+
 # TODO: Currently only supports one user, we would have to differentiate user tokens in storage.
 def getFlickrAPI(config):
 	"""Obtains the Flickr API interface and loads local OAuth tokens if necessary.
@@ -23,7 +91,14 @@ def getFlickrAPI(config):
 	"""
 	logger.info('Obtaining Flickr API, checking credentials in: "{}"'.format(config.dir_))
 	flickr = flickrapi.FlickrAPI(config.api_key, config.api_secret,
-			token_cache_location=config.dir_, format='parsed-json')
+			token_cache_location=config.dir_, format='parsed-json', timeout=config.http_timeout)
+	# flickrapi sends every API call and upload through one class-level session. Its default
+	# pool keeps 10 connections alive per host, size it for the concurrency instead.
+	# In tree mode each album syncing at once has its own workers.
+	pool_size = max(config.upload_workers, config.download_workers, LIST_PAGE_WORKERS)
+	if config.tree:
+		pool_size *= config.album_workers
+	flickrapi.auth.OAuthFlickrInterface.session.mount('https://', newHTTPAdapter(pool_size))
 
 	if not flickr.token_valid(perms='delete'):
 		logger.info('No OAuth token for user')
@@ -35,35 +110,170 @@ def getFlickrAPI(config):
 		raise SyncError("Couldn't get an OAuth token")
 
 	user_id = token['oauth']['user']['nsid']
-	return FlickrWrapper(flickr, user_id)
+	rate_limiter = None
+	if config.api_calls_per_hour:
+		rate_limiter = TokenBucket(config.api_calls_per_hour / 3600, config.api_burst)
+	# Bandwidth limits are in KiB/s and allow bursts of one second's worth.
+	upload_limiter = None
+	if config.upload_limit:
+		upload_limiter = TokenBucket(config.upload_limit * 1024, config.upload_limit * 1024)
+	download_limiter = None
+	if config.download_limit:
+		download_limiter = TokenBucket(config.download_limit * 1024,
+				config.download_limit * 1024)
+	return FlickrWrapper(flickr, user_id, rate_limiter, newSession(pool_size),
+			config.http_timeout, upload_limiter, download_limiter)
+
+
+def newHTTPAdapter(pool_size):
+	"""Returns a requests transport adapter that keeps up to pool_size connections alive per
+	host.
+	"""
+	return requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+
+def newSession(pool_size):
+	"""Returns a requests session that keeps up to pool_size connections alive per host, so
+	concurrent downloads reuse their connections instead of reconnecting for each photo.
+	"""
+	session = requests.Session()
+	adapter = newHTTPAdapter(pool_size)
+	session.mount('https://', adapter)
+	session.mount('http://', adapter)
+	return session
+
+
+class HashingReader():
+	"""Wraps a binary file, or a reader like ThrottledReader, so the content read from it also
+	updates a hashlib object. Has the attributes that flickrapi's uploads need of a file object.
+	"""
+	def __init__(self, f, digest):
+		self.file = f
+		self.digest = digest
+		self.len = os.fstat(f.fileno()).st_size
+		self.fileno = f.fileno
+		self.tell = f.tell
+
+	def read(self, size=-1):
+		data = self.file.read(size)
+		self.digest.update(data)
+		return data
 
 
 class FlickrWrapper():
 	"""Wraps the FlickerAPI for the commonly used functions."""
-	def __init__(self, flickr, user_id):
+	def __init__(self, flickr, user_id, rate_limiter=None, session=None,
+			timeout=DEFAULT_HTTP_TIMEOUT, upload_limiter=None, download_limiter=None):
+		"""Args:
+
+		flickr - flickrapi.FlickrAPI object.
+		user_id - NSID of the user whose photos are synced.
+		rate_limiter - TokenBucket every API call must pass through. (Optional)
+		session - requests.Session that downloads share. (Optional)
+		timeout - Seconds to wait for a download to connect or send data. (Optional)
+		upload_limiter - TokenBucket of bytes that all uploads share. (Optional)
+		download_limiter - TokenBucket of bytes that all downloads share. (Optional)
+		"""
 		self.flickr = flickr
 		self.user_id = user_id
+		self.rate_limiter = rate_limiter
+		self.session = session or requests.Session()
+		self.timeout = timeout
+		self.upload_limiter = upload_limiter
+		self.download_limiter = download_limiter
+		# Number of calls made per API method.
+		self.call_counts = collections.Counter()
+		self.call_counts_lock = threading.Lock()
+		# Concurrent uploads may all find their album missing. Only one of them may create it,
+		# the rest add their photo to the album it created. Keyed on (album_name, album_id).
+		self.album_lock = threading.Lock()
+		self.created_albums = {}
+		# AdaptiveLimits of transfers by kind, shared by the syncs that use this wrapper.
+		self.transfer_limits = {}
+
+	def _call(self, method, *args, **kwargs):
+		"""Calls the API method named like "photosets.getList", after waiting for the rate
+		limiter. Returns the API response.
+		"""
+		if self.rate_limiter:
+			self.rate_limiter.acquire()
+		with self.call_counts_lock:
+			self.call_counts[method] += 1
+		func = functools.reduce(getattr, method.split('.'), self.flickr)
+		return func(*args, **kwargs)
+
+	def _callWithFile(self, method, filename, *args, digest=None, **kwargs):
+		"""Calls the upload or replace API method with a file, which is read through the upload
+		limiter. If digest, a hashlib object, is set it's updated with the file's content as the
+		file is read. Returns the API response.
+		"""
+		if not self.upload_limiter and not digest:
+			return self._call(method, filename, *args, **kwargs)
+		with open(filename, 'rb') as f:
+			fileobj = f
+			if self.upload_limiter:
+				fileobj = ThrottledReader(fileobj, self.upload_limiter)
+			if digest:
+				fileobj = HashingReader(fileobj, digest)
+			resp = self._call(method, filename, *args, fileobj=fileobj, **kwargs)
+			# The digest must cover the whole file, even if the upload didn't read all of it.
+			if digest:
+				for blk in iter(lambda: f.read(2**20), b''):
+					digest.update(blk)
+			return resp
 
 	def getAlbumID(self, album_name):
 		"""Get album's unique ID. Must iterate over pages of albums to find it.
 		"""
-		# Pages are indexed from 1. Total page count is read from the API response.
-		page_num = 1
-		page_count = 1
-		while page_num <= page_count:
-			page = self.flickr.photosets.getList(user_id=self.user_id, page=page_num)
-			page_count = page['photosets']['pages']
-			page_num += 1
-			for album in page['photosets']['photoset']:
-				if album['title']['_content'] == album_name:
-					return album['id']
+		def findAlbum(pages):
+			for page in pages:
+				for album in page['photoset']:
+					if album['title']['_content'] == album_name:
+						return album['id']
+			return None
+
+		# Most users' albums fit on the first page, only fetch the rest if it's not there.
+		first_page = self._getAlbumsPage(1)
+		album_id = findAlbum([first_page])
+		if album_id is None:
+			album_id = findAlbum(self._getRemainingPages(self._getAlbumsPage,
+					first_page['pages']))
+		if album_id is not None:
+			return album_id
 		logger.debug('No album with name {}. It can be created later.'.format(album_name))
 		return None
 
+	def listAlbums(self):
+		"""Lists all of the user's albums in one pass. Returns a dict of album name->ID. If
+		there are multiple albums with the same name, the first one wins, like getAlbumID().
+		"""
+		first_page = self._getAlbumsPage(1)
+		pages = [first_page] + self._getRemainingPages(self._getAlbumsPage, first_page['pages'])
+		albums = {}
+		for page in pages:
+			for album in page['photoset']:
+				albums.setdefault(album['title']['_content'], album['id'])
+		logger.info('Listed {} albums'.format(len(albums)))
+		return albums
+
+	def _getAlbumsPage(self, page_num):
+		"""Fetches one page of the user's list of albums.
+		"""
+		page = self._call('photosets.getList', user_id=self.user_id, page=page_num,
+				per_page=LIST_PAGE_SIZE)
+		return page['photosets']
+
+	def _getRemainingPages(self, get_page, page_count):
+		"""Fetches pages 2 through page_count of a listing concurrently, using get_page(page_num).
+		Returns the pages in order.
+		"""
+		with concurrent.futures.ThreadPoolExecutor(max_workers=LIST_PAGE_WORKERS) as executor:
+			return list(executor.map(get_page, range(2, page_count + 1)))
+
 	def createAlbum(self, album_name, photo_id):
 		"""Create a Flickr album. A default photo is required.
 		"""
-		resp = self.flickr.photosets.create(title=album_name, primary_photo_id=photo_id)
+		resp = self._call('photosets.create', title=album_name, primary_photo_id=photo_id)
 		logger.info('Creating album: ' + str(resp))
 		if resp['stat'] != 'ok':
 			raise SyncError('Could not create album "{}", err={}'.format(album_name, resp['stat']))
@@ -72,37 +282,127 @@ class FlickrWrapper():
 	def listAlbum(self, album_id):
 		"""List the photos in an album.
 		"""
-		# Download all the album pages. Pages are indexed from 1. Update the
-		# page count once we make an API request.
-		# TODO: use the "for p in flickr.walk_set(config.album_id, per_page=500)" API?
-		# See https://stuvel.eu/flickrapi-doc/7-util.html#walking-through-all-photos-in-a-set .
-		page_num = 1
-		page_count = 1
-		results = []
-		while page_num <= page_count:
-			page = self.flickr.photosets.getPhotos(photoset_id=album_id, user_id=self.user_id,
-					page=page_num, extras='tags')
-			page_count = page['photoset']['pages']
-			page_num += 1
+		def getPage(page_num):
+			page = self._call('photosets.getPhotos', photoset_id=album_id, user_id=self.user_id,
+					page=page_num, per_page=LIST_PAGE_SIZE, extras=LIST_EXTRAS)
 			logger.debug('Album {} listing: {}'.format(album_id, page))
-			results += page['photoset']['photo']
+			return page['photoset']
+
+		# Pages are indexed from 1. The first page has the page count.
+		first_page = getPage(1)
+		pages = [first_page] + self._getRemainingPages(getPage, first_page['pages'])
+		results = []
+		for page in pages:
+			results += page['photo']
+		return results
+
+	def getAlbumInfo(self, album_id):
+		"""Returns an album's metadata, including "date_update", "photos" and "videos" (the
+		counts).
+		"""
+		return self._call('photosets.getInfo', photoset_id=album_id)['photoset']
+
+	def listRecentlyUpdated(self, min_date):
+		"""List the user's photos updated since min_date (a Unix timestamp), with the same
+		fields as listAlbum().
+		"""
+		def getPage(page_num):
+			page = self._call('photos.recentlyUpdated', min_date=min_date, page=page_num,
+					per_page=LIST_PAGE_SIZE, extras=LIST_EXTRAS)
+			return page['photos']
+
+		first_page = getPage(1)
+		pages = [first_page] + self._getRemainingPages(getPage, first_page['pages'])
+		results = []
+		for page in pages:
+			results += page['photo']
 		return results
 
+	def listChecksummed(self):
+		"""List all of the user's photos that have a checksum tag, with their "machine_tags".
+		"""
+		# A machine tag query without a value matches any value.
+		def search(min_date, max_date):
+			def getPage(page_num):
+				page = self._call('photos.search', user_id=self.user_id,
+						machine_tags=CHECKSUM_TAG_PREFIX, min_upload_date=min_date,
+						max_upload_date=max_date, page=page_num, per_page=LIST_PAGE_SIZE,
+						extras='machine_tags')
+				return page['photos']
+			return getPage, getPage(1)
+
+		# Searches past the result limit are split in two by upload date until each fits. The
+		# dates are inclusive, so the halves don't overlap.
+		photos = {}
+		total = None
+		windows = [(0, int(time.time()) + 86400)]
+		while windows:
+			min_date, max_date = windows.pop()
+			getPage, first_page = search(min_date, max_date)
+			count = int(first_page['total'])
+			if total is None:
+				total = count
+			if count > SEARCH_RESULT_LIMIT and min_date < max_date:
+				middle = (min_date + max_date) // 2
+				windows += [(middle + 1, max_date), (min_date, middle)]
+				continue
+			for page in [first_page] + self._getRemainingPages(getPage, first_page['pages']):
+				for p in page['photo']:
+					photos[p['id']] = p
+		if len(photos) != total:
+			logger.warning('Searching for checksummed photos found {}, Flickr counts {}'.format(
+					len(photos), total))
+		return list(photos.values())
+
+	def addTags(self, photo_id, tags):
+		"""Add space-delimited tags to a photo. Returns nothing, raises exception for error.
+		"""
+		self._call('photos.addTags', photo_id=photo_id, tags=tags)
+
 	def delete(self, photo_id):
 		"""Delete a photo from flickr. Returns nothing, raises exception for error.
 		"""
-		self.flickr.photos.delete(photo_id=photo_id)
+		self._call('photos.delete', photo_id=photo_id)
 
 	def upload(self, filename, title, tags, album_name=None, album_id=None):
 		"""Upload a file to an album id. Create the album named album_name the id doesn't exist. Returns the used album id, or None if the upload didn't complete. Uploads must be added
 		to an album.
 		"""
-		# The upload API only supports XML responses, so use "etree".
+		photo_id = self.uploadPhoto(filename, title, tags)
+		if photo_id is None:
+			return None
+		return self.addToAlbum(photo_id, album_name, album_id)
+
+	def uploadPhoto(self, filename, title, tags, digest=None):
+		"""Upload a file as a new photo, in no album. If digest, a hashlib object, is set it's
+		updated with the file's content as it's uploaded. Returns the new photo's id, or None if
+		Flickr rejected the file.
+		"""
 		logger.info('Uploading photo: ' + filename)
+		resp = self._upload(filename, title, tags, digest)
+		return resp.find('photoid').text if resp is not None else None
+
+	def uploadPhotoAsync(self, filename, title, tags, digest=None):
+		"""Upload a file as a new photo, in no album, without waiting for Flickr to process
+		it. digest is like for uploadPhoto(). Returns a ticket id to pass to checkTickets(), or
+		None if Flickr rejected the file.
+		"""
+		logger.info('Uploading photo asynchronously: ' + filename)
+		# "async" is a Python keyword, it can only be passed as a keyword argument this way.
+		resp = self._upload(filename, title, tags, digest, **{'async': 1})
+		return resp.find('ticketid').text if resp is not None else None
+
+	def _upload(self, filename, title, tags, digest=None, **kwargs):
+		"""Uploads a file. Returns the response, or None if Flickr rejected the file.
+		"""
+		# The upload API only supports XML responses, so use "etree".
 		try:
-			resp = self.flickr.upload(filename, title=title, tags=tags, format='etree',
-					is_public=1, is_friend=0, is_family=0)
+			resp = self._callWithFile('upload', filename, digest=digest, title=title, tags=tags,
+					format='etree', is_public=1, is_friend=0, is_family=0, **kwargs)
 		except flickrapi.exceptions.FlickrError as e:
+			# Let the caller retry failures that aren't about the file.
+			if isTransientError(e):
+				raise
 			if e.code == 5:
 				logger.info('File {} is not an accepted file type, skipping'.format(filename))
 			return None
@@ -110,37 +410,159 @@ class FlickrWrapper():
 		if resp.attrib['stat'] != 'ok':
 			raise SyncError('Could not upload photo "{}", err={}'.format(filename,
 					resp.attrib['stat']))
-		photo_id = resp.find('photoid').text
+		return resp
 
+	def checkTickets(self, ticket_ids):
+		"""Checks on asynchronous uploads. Returns a dict of ticket id->photo id for the
+		uploads that completed and ticket id->None for the ones that failed. Tickets still being
+		processed are left out.
+		"""
+		results = {}
+		for i in range(0, len(ticket_ids), TICKET_CHECK_BATCH):
+			resp = self._call('photos.upload.checkTickets',
+					tickets=','.join(ticket_ids[i:i + TICKET_CHECK_BATCH]))
+			for ticket in resp['uploader']['ticket']:
+				# "complete" is 0 while processing, 1 when done, and 2 if processing failed.
+				complete = int(ticket.get('complete', 0))
+				if complete == 1:
+					results[ticket['id']] = ticket['photoid']
+				elif complete == 2 or ticket.get('invalid'):
+					results[ticket['id']] = None
+		return results
+
+	def replace(self, filename, photo_id):
+		"""Replace the content of an existing photo with a file. The photo keeps its id, album
+		membership, and metadata. Returns nothing, raises exception for error.
+		"""
+		# The replace API only supports XML responses, so use "etree".
+		logger.info('Replacing photo {} with {}'.format(photo_id, filename))
+		try:
+			resp = self._callWithFile('replace', filename, photo_id, format='etree')
+		except flickrapi.exceptions.FlickrError as e:
+			if isTransientError(e):
+				raise
+			raise SyncError('Could not replace photo {} with "{}": {}'.format(photo_id, filename,
+					e))
+		if resp.attrib['stat'] != 'ok':
+			raise SyncError('Could not replace photo {} with "{}", err={}'.format(photo_id,
+					filename, resp.attrib['stat']))
+
+	def getTags(self, photo_id):
+		"""Returns a photo's tags as a list, as they were set. Album listings only have them
+		normalized, eg. "newyork" for "New York".
+		"""
+		info = self._call('photos.getInfo', photo_id=photo_id)
+		return [t['raw'] for t in info['photo']['tags']['tag']]
+
+	def setTags(self, photo_id, tags):
+		"""Replace all of a photo's tags with the list tags. Returns nothing, raises exception
+		for error.
+		"""
+		# Tags are space-delimited, ones with spaces are quoted.
+		tags = ['"{}"'.format(t) if ' ' in t else t for t in tags]
+		self._call('photos.setTags', photo_id=photo_id, tags=' '.join(tags))
+
+	def setTitle(self, photo_id, title):
+		"""Change a photo's title. Returns nothing, raises exception for error.
+		"""
+		self._call('photos.setMeta', photo_id=photo_id, title=title)
+
+	def addToAlbum(self, photo_id, album_name, album_id):
+		"""Add a photo to an album. Returns the used album id, which is new if the album had
+		to be created, or None if the photo doesn't exist.
+		"""
 		# Add the new photo to the destination album. Create the album if it doesn't exist
 		# yet. It may not exist because albums can't be empty (and they are automatically removed
 		# when emptied), so a photo must be uploaded first. Creating the album and adding a cover
 		# photo adds that photo to the album.
 		try:
-			self.flickr.photosets.addPhoto(photoset_id=album_id, photo_id=photo_id)
+			self._call('photosets.addPhoto', photoset_id=album_id, photo_id=photo_id)
 		except flickrapi.exceptions.FlickrError as e:
+			if isTransientError(e):
+				raise
 			# Code "1" means "album ID not found".
 			if e.code == 1:
+				album_id = self._addToMissingAlbum(album_name, album_id, photo_id)
+			# Code "2" means "photo not found".
+			elif e.code == 2:
+				logger.info('Photo {} not found, not adding it to album {}'.format(photo_id,
+						album_id))
+				return None
+		return album_id
+
+	def _createMissingAlbum(self, album_name, album_id, photo_id):
+		"""Creates the album that replaces a missing album, with photo_id as its cover. Returns
+		(new album id, whether this call created it). Concurrent callers for the same missing
+		album share the one album created by the first caller.
+		"""
+		with self.album_lock:
+			new_album_id = self.created_albums.get((album_name, album_id))
+			if new_album_id is None:
 				msg = "Album ID {} doesn't exist, creating it".format(album_id)
 				logger.debug(msg)
 				updateStatus(msg)
-				album_id = self.createAlbum(album_name, photo_id)
-		return album_id
+				new_album_id = self.createAlbum(album_name, photo_id)
+				self.created_albums[(album_name, album_id)] = new_album_id
+				return new_album_id, True
+			return new_album_id, False
+
+	def _addToMissingAlbum(self, album_name, album_id, photo_id):
+		"""Adds a photo to an album that doesn't exist (anymore) by creating the album with the
+		photo as its cover. Returns the new album id.
+		"""
+		new_album_id, created = self._createMissingAlbum(album_name, album_id, photo_id)
+		if not created:
+			self._call('photosets.addPhoto', photoset_id=new_album_id, photo_id=photo_id)
+		return new_album_id
 
-	def download(self, photo_id):
-		"""Downloads a photo and returns it as raw bytes.
+	def download(self, photo_id, output_path, fsync=False, url=''):
+		"""Downloads a photo to output_path. Returns nothing, raises exception for error.
+
+		The content is streamed to a temp file next to output_path, which is renamed over
+		output_path once complete. A crash never leaves a half-written file at output_path. If
+		fsync is set, the content is flushed to disk before the rename. If url is set, it's used
+		as the original's URL instead of looking it up.
 		"""
+		if url:
+			logger.info('Downloading: ' + photo_id)
+			self._downloadURL(url, output_path, fsync)
+			return
+
 		# getSizes() fetches the resolutions available for the photo, including their URLs. Use
 		# the resolution named 'Original' to get back what upload() put in. (AFAIK it's always
 		# available.)
-		sizes = self.flickr.photos.getSizes(photo_id=photo_id)
+		sizes = self._call('photos.getSizes', photo_id=photo_id)
 		logger.debug('Resolutions available for {}: {}'.format(photo_id, sizes))
 		for s in sizes['sizes']['size']:
 			if s['label'] == 'Original':
 				logger.info('Downloading: ' + photo_id)
 				# Property 'source' is the URL for the image data, property 'url' is just a
 				# web page that shows it.
-				r = urllib.request.urlopen(s['source'])
-				return r.read()
-		raise SyncError('Could not download image "{}" because Flickr provided no URL for ' +
-					'the "Original" image resolution.'.format(photo_id))
+				self._downloadURL(s['source'], output_path, fsync)
+				return
+		raise SyncError(('Could not download image "{}" because Flickr provided no URL for ' +
+					'the "Original" image resolution.').format(photo_id))
+
+	def _downloadURL(self, url, output_path, fsync):
+		"""Streams the content at url to output_path via a temp file in the same directory.
+		"""
+		tmp_path = os.path.join(os.path.dirname(output_path),
+				PARTIAL_DOWNLOAD_PREFIX + uuid.uuid4().hex)
+		r = self.session.get(url, stream=True, timeout=self.timeout)
+		try:
+			r.raise_for_status()
+			with open(tmp_path, 'xb') as f:
+				for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+					if self.download_limiter:
+						self.download_limiter.acquire(len(chunk))
+					f.write(chunk)
+				if fsync:
+					f.flush()
+					os.fsync(f.fileno())
+			os.replace(tmp_path, output_path)
+		except BaseException:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+		finally:
+			r.close()
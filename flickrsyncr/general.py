@@ -13,6 +13,10 @@ VERSION = '0.2.1'  # The canonical version definition.
 CHECKSUM_TAG_PREFIX = 'checksum:md5='
 CHECKSUM_TAG_PREFIX_NORMALIZED = 'checksummd5'
 
+# Downloads are written to a hidden temp file with this prefix and then renamed into place. Files
+# with the prefix are partial downloads, they are never treated as photos.
+PARTIAL_DOWNLOAD_PREFIX = '.flickrsyncr-partial-'
+
 
 # Custom exception class used to terminate execution.
 class SyncError(Exception):
@@ -0,0 +1,128 @@
+"""Write-ahead journal of a sync's plan and progress, so an interrupted sync can be resumed."""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+__all__ = ['Journal']
+logger = logging.getLogger(__name__)
+
+
+JOURNAL_PREFIX = 'journal-'
+
+# The settings that determine a sync's plan. A journal is only resumed by a sync with the same
+# settings.
+JOURNAL_SETTINGS = ['album', 'path', 'push', 'pull', 'sync', 'checksum', 'tag']
+
+
+class Journal():
+	"""A JSON-lines file in the config dir, one per album and local path. The first line is the
+	plan: the steps of the sync, each an action and the photos it applies to. Each following line
+	records a completed operation, appended and flushed to disk as soon as it completes, or
+	progress on one that hasn't completed yet.
+	"""
+	def __init__(self, config_dir, album, path):
+		key = hashlib.md5('{}\n{}'.format(album, os.path.abspath(path)).encode('utf-8'))
+		self.filename = os.path.join(config_dir, JOURNAL_PREFIX + key.hexdigest() + '.jsonl')
+		self.lock = threading.Lock()
+		self.done = set()
+		# (step, key) -> info noted about operations that haven't completed.
+		self.notes = {}
+		self.album_id = None
+
+	def start(self, config, steps):
+		"""Records a new plan, replacing any previous journal. steps is a list of
+		[action, [photo dict, ...]].
+		"""
+		header = {setting : getattr(config, setting) for setting in JOURNAL_SETTINGS}
+		header['album_id'] = config.album_id
+		header['steps'] = steps
+		os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+		with open(self.filename, 'w') as f:
+			f.write(json.dumps(header) + '\n')
+			f.flush()
+			os.fsync(f.fileno())
+		self.done = set()
+		self.notes = {}
+		self.album_id = config.album_id
+
+	def load(self, config):
+		"""Reads the journal left by an interrupted sync. Returns its list of steps, or None if
+		there is no journal. Raises ValueError if it was written by a sync with different
+		settings.
+		"""
+		try:
+			with open(self.filename, 'r') as f:
+				lines = f.read().splitlines()
+		except FileNotFoundError:
+			return None
+		if not lines:
+			return None
+
+		header = json.loads(lines[0])
+		for setting in JOURNAL_SETTINGS:
+			if header[setting] != getattr(config, setting):
+				raise ValueError('the interrupted sync had {}={}, not {}'.format(setting,
+						header[setting], getattr(config, setting)))
+
+		self.album_id = header['album_id']
+		for line in lines[1:]:
+			try:
+				record = json.loads(line)
+			except ValueError:
+				# The crash happened mid-write, the operation wasn't recorded as done.
+				logger.warning('Ignoring truncated journal record: ' + line)
+				continue
+			key = (record.pop('step'), record.pop('key'))
+			if not record.pop('done', True):
+				self.notes.setdefault(key, {}).update(record)
+				continue
+			self.done.add(key)
+			if record.get('album_id'):
+				self.album_id = record['album_id']
+		logger.info('Loaded journal "{}" with {} completed operations'.format(self.filename,
+				len(self.done)))
+		return header['steps']
+
+	def isDone(self, step, key):
+		"""Returns whether the operation on the photo identified by key in step completed.
+		"""
+		return (step, key) in self.done
+
+	def noted(self, step, key):
+		"""Returns the info noted about the operation on the photo identified by key in step,
+		a dict that is empty if nothing was.
+		"""
+		return self.notes.get((step, key), {})
+
+	def record(self, step, key, **info):
+		"""Records that the operation on the photo identified by key in step completed. info is
+		stored alongside, eg. the id of an uploaded photo and the album it went into.
+		"""
+		self._append(dict(info, step=step, key=key))
+		with self.lock:
+			self.done.add((step, key))
+
+	def note(self, step, key, **info):
+		"""Records progress on the operation on the photo identified by key in step, which
+		hasn't completed, eg. the id of a photo that was uploaded but isn't in the album yet.
+		A resumed sync gets info back from noted().
+		"""
+		self._append(dict(info, step=step, key=key, done=False))
+		with self.lock:
+			self.notes.setdefault((step, key), {}).update(info)
+
+	def _append(self, record):
+		with self.lock:
+			with open(self.filename, 'a') as f:
+				f.write(json.dumps(record) + '\n')
+				f.flush()
+				os.fsync(f.fileno())
+
+	def finish(self):
+		"""Removes the journal once the sync completed, there's nothing left to resume.
+		"""
+		if os.path.exists(self.filename):
+			os.remove(self.filename)
@@ -1,21 +1,48 @@
 """Logic for merging and transferring content between local and Flickr."""
+import concurrent.futures
+import copy
+import fnmatch
 import hashlib
 import logging
+import mimetypes
 import os
+import random
+import threading
+import time
 
 import magic
 
+from .cache import ChecksumIndex
+from .cache import LocalCache
+from .cache import RemoteCatalog
 from .general import SyncError
 from .general import CHECKSUM_TAG_PREFIX
 from .general import CHECKSUM_TAG_PREFIX_NORMALIZED
+from .general import PARTIAL_DOWNLOAD_PREFIX
 from .config import Config
+from .flickrwrapper import isServiceError
+from .flickrwrapper import isTransientError
+from .journal import Journal
 from .status import updateStatus
+from .throttle import AdaptiveLimit
+from .tree import treeAlbums
 
 
 __all__ = ['sync']
 logger = logging.getLogger(__name__)
 
 
+# Transient failures are retried after a random delay of up to RETRY_BASE_DELAY * 2^attempt
+# seconds, capped at RETRY_MAX_DELAY.
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 60
+
+# Asynchronous uploads are polled this often, in seconds, and given up on after
+# UPLOAD_TICKET_TIMEOUT seconds.
+UPLOAD_TICKET_POLL_INTERVAL = 2
+UPLOAD_TICKET_TIMEOUT = 3600
+
+
 class _Photo():
 	def __repr__(self):
 		return self.title
@@ -29,20 +56,38 @@ class _Photo():
 	def transfer(self, config):
 		pass
 
+	def transferredBytes(self, config):
+		pass
+
 
 class LocalPhoto(_Photo):
 	"""A photo on the local filesystem."""
-	def __init__(self, flickrwrapper, title, path):
+	def __init__(self, flickrwrapper, title, path, cache=None, st=None):
 		"""Create an object representation of a file. Args:
 
 		flickrwrapper - FlickrWrapper API object.
 		title - The name of the file, which is the title of the photo it would upload to.
 		path - The directory the file is in.
+		cache - LocalCache for the directory, avoids re-hashing unchanged files. (Optional)
+		st - The file's stat result from when it was listed, saves stat'ing it again. (Optional)
 		"""
-		logger.info('New local photo: title={}, path={}'.format(title, path))
+		logger.debug('New local photo: title={}, path={}'.format(title, path))
 		self.flickrwrapper = flickrwrapper
 		self.title = title
 		self.path = path
+		self.cache = cache
+		self.st = st
+		# Set once the file is uploaded.
+		self.photo_id = None
+		# Set once the file is uploaded asynchronously, until Flickr has processed it.
+		self.ticket_id = None
+		# Id of a photo elsewhere in the account with the same content, added to the album
+		# instead of uploading the file.
+		self.duplicate_of = None
+		# Checksum calculated while uploading, the photo isn't tagged with it yet.
+		self.upload_checksum = None
+		# Size of the file as of the last upload.
+		self.uploaded_bytes = None
 
 	def __eq__(self, other):
 		"""Required for sorting.
@@ -65,20 +110,37 @@ class LocalPhoto(_Photo):
 			logger.info('Deleting from local: ' + f)
 			os.remove(f)
 
-	def _compileTags(self, config):
-		# Assemble the tags to apply. The user custom tag plus the checksum tag. Convert to a
-		# space-delimited string afterward.
+	def _compileTags(self, config, checksum_tag=True):
+		# Assemble the tags to apply. The user custom tag plus the checksum tag, unless
+		# checksum_tag is False. Convert to a space-delimited string afterward.
 		tags = []
 		if config.tag:
 			tags.append(config.tag)
-		if config.checksum:
+		if config.checksum and checksum_tag:
 			tags.append(createChecksumTag(self.checksum()))
 		return ' '.join(tags)
 
+	def _cachedChecksum(self, st):
+		"""Returns the file's checksum if it's cached for the stat result st, otherwise None.
+		"""
+		if not self.cache:
+			return None
+		checksum = self.cache.get(self.title, st, 'md5')
+		if checksum:
+			logger.debug('Cached checksum for photo "{}": {}'.format(self.title, checksum))
+		return checksum
+
 	# Calculate the checksum of a local file. Return it as a hex string.
 	# Use MD5 as the checksum. (This isn't for security.)
 	def checksum(self):
 		filename = os.path.join(self.path, self.title)
+		# Stat before reading, so a file modified mid-read is re-hashed next time. The stat from
+		# listing the file also came before reading it.
+		st = self.st or os.stat(filename)
+		checksum = self._cachedChecksum(st)
+		if checksum:
+			return checksum
+
 		hash_ctx = hashlib.md5()
 		with open(filename, 'rb') as f:
 			# Read in 1 MiB chuck sizes.
@@ -86,52 +148,209 @@ class LocalPhoto(_Photo):
 				hash_ctx.update(blk)
 		checksum = hash_ctx.hexdigest()
 		logger.debug('Calculated checksum for photo "{}": {}'.format(self.title, checksum))
+		if self.cache:
+			self.cache.put(self.title, st, 'md5', checksum)
 		return checksum
 
-	def transfer(self, config):
-		"""Upload the local file to Flickr.
+	def mimeType(self):
+		"""Returns the file's MIME type. Files with an image extension are trusted to be images,
+		others are sniffed from their content. Sniffed types are cached.
 		"""
+		mime_type = mimetypes.guess_type(self.title)[0]
+		if mime_type and mime_type.startswith('image/'):
+			return mime_type
+
 		filename = os.path.join(self.path, self.title)
+		st = self.st or os.stat(filename)
+		if self.cache:
+			mime_type = self.cache.get(self.title, st, 'mime')
+			if mime_type:
+				return mime_type
 
-		# Sanity-check file's MIME type and only handle images (which start with "image/").
 		# Read a peek of the file's content and give it to from_buffer(). Don't use
 		# magic.from_file() because it isn't compatable with unit tests (it imports a C library
 		# that can't be patched by pyfakefs).
 		with open(filename, 'rb') as f:
-			file_type = magic.from_buffer(f.read(1024), mime=True)
-		if not file_type.startswith('image/'):
-			updateStatus('Skipping non-image: ' + filename)
-			return
+			mime_type = magic.from_buffer(f.read(1024), mime=True)
+		logger.debug('Sniffed MIME type of "{}": {}'.format(self.title, mime_type))
+		if self.cache:
+			self.cache.put(self.title, st, 'mime', mime_type)
+		return mime_type
+
+	def transfer(self, config, album_batch=None, tickets=None, uploaded=None):
+		"""Upload the local file to Flickr. If album_batch is set, the photo is added to it
+		instead of to the album directly. If tickets is set, the upload is asynchronous: the
+		ticket is added to it and the photo is added to the album once the ticket resolves.
+		uploaded(photo) is called as soon as Flickr returns the photo's id or ticket. Only
+		images should be transferred, see classifyPhotos().
+		"""
+		filename = os.path.join(self.path, self.title)
+		self.uploaded_bytes = None
+		if self.duplicate_of:
+			updateStatus('Adding existing photo {} to album: {}'.format(self.duplicate_of,
+					filename))
+			if config.dryrun or self._addDuplicate(config):
+				return
 
 		updateStatus('Uploading: ' + filename)
 		if not config.dryrun:
 			logger.info('Uploading {} to album_id {}'.format(filename, config.album_id))
-			# TODO: Uploads are serial, add parallel?
-			tags = self._compileTags(config)
-			uploaded_album_id = self.flickrwrapper.upload(filename, self.title, tags,
-						config.album, config.album_id)
+			# An upload an interrupted sync already made is waited for instead of repeated.
+			if self.photo_id is None and self.ticket_id is not None:
+				if tickets is not None:
+					tickets.add(self, self.ticket_id)
+					return
+				self._waitForTicket(config, uploaded)
+			# A retried transfer doesn't upload the photo again if only adding it to the album
+			# failed.
+			if self.photo_id is None:
+				# A checksum that isn't known yet is calculated from the upload's read of the
+				# file, instead of reading the file first. The photo is tagged with it after.
+				st = self.st or os.stat(filename)
+				digest = None
+				if config.checksum and not self._cachedChecksum(st):
+					digest = hashlib.md5()
+				tags = self._compileTags(config, checksum_tag=digest is None)
+				self.uploaded_bytes = st.st_size
+				if tickets is not None:
+					ticket_id = self.flickrwrapper.uploadPhotoAsync(filename, self.title, tags,
+							digest)
+					if ticket_id is not None:
+						self._keepUploadChecksum(st, digest)
+						self.ticket_id = ticket_id
+						if uploaded:
+							uploaded(self)
+						tickets.add(self, ticket_id)
+						return
+				else:
+					self.photo_id = self.flickrwrapper.uploadPhoto(filename, self.title, tags,
+							digest)
+					if self.photo_id is not None:
+						self._keepUploadChecksum(st, digest)
+						if uploaded:
+							uploaded(self)
 			# It's possible Flickr will reject the content even after the MIME filter.
-			if uploaded_album_id == None:
+			if self.photo_id is None:
 				updateStatus('...failed to upload to Flickr')
 			else:
-				config.album_id = uploaded_album_id
+				self.finishUpload(config, album_batch)
+
+	def transferredBytes(self, config):
+		"""Returns the size in bytes of the file the last transfer uploaded, or None if it
+		didn't upload, eg. it only added the photo to the album.
+		"""
+		return self.uploaded_bytes
+
+	def _waitForTicket(self, config, uploaded=None):
+		"""Waits for Flickr to process the asynchronous upload with ticket_id, and sets
+		photo_id. Raises a SyncError if Flickr failed to.
+		"""
+		tickets = UploadTickets(self.flickrwrapper, uploaded)
+		tickets.add(self, self.ticket_id)
+		_, errors = tickets.wait(config)
+		if errors:
+			raise errors[0]
+
+	def _keepUploadChecksum(self, st, digest):
+		"""Keeps the checksum calculated while uploading, if digest is set, to tag the photo
+		with. It's cached for the stat result st, from before the upload read the file.
+		"""
+		if not digest:
+			return
+		self.upload_checksum = digest.hexdigest()
+		logger.debug('Calculated checksum while uploading "{}": {}'.format(self.title,
+				self.upload_checksum))
+		if self.cache:
+			self.cache.put(self.title, st, 'md5', self.upload_checksum)
+
+	def finishUpload(self, config, album_batch=None):
+		"""Finishes an upload once Flickr has the photo: tags it with the checksum calculated
+		while uploading, if any, and adds it to the album, or to album_batch if it's set.
+		"""
+		if self.upload_checksum:
+			self.flickrwrapper.addTags(self.photo_id, createChecksumTag(self.upload_checksum))
+			self.upload_checksum = None
+		self.addToAlbum(config, album_batch)
+
+	def addToAlbum(self, config, album_batch=None):
+		"""Add the uploaded photo to the album, or to album_batch if it's set.
+		"""
+		if album_batch:
+			album_batch.add(self)
+		else:
+			album_id = self.flickrwrapper.addToAlbum(self.photo_id, config.album,
+					config.album_id)
+			config.album_id = album_id or config.album_id
+
+	def _addDuplicate(self, config):
+		"""Adds the existing photo with the same content to the album. Returns False if that
+		photo no longer exists and the file must be uploaded after all.
+		"""
+		album_id = self.flickrwrapper.addToAlbum(self.duplicate_of, config.album,
+				config.album_id)
+		if album_id is None:
+			updateStatus('...existing photo is gone, uploading instead')
+			self.duplicate_of = None
+			return False
+		self.photo_id = self.duplicate_of
+		config.album_id = album_id
+		# Photos without the tag are ignored, the photo would be added again on every push.
+		# Adding a tag the photo already has does nothing.
+		if config.tag:
+			self.flickrwrapper.addTags(self.photo_id, config.tag)
+		return True
+
+	def replace(self, config, remote_photo):
+		"""Upload the local file over the content of an existing Flickr photo. The photo keeps
+		its id, album membership, and tags, except the checksum tag is updated.
+		"""
+		filename = os.path.join(self.path, self.title)
+		updateStatus('Replacing: ' + filename)
+		if not config.dryrun:
+			logger.info('Replacing photo {} with {}'.format(remote_photo.photo_id, filename))
+			self.flickrwrapper.replace(filename, remote_photo.photo_id)
+			# Only the checksum tag changes. The tags are set again as they were set, not as the
+			# album listing normalized them.
+			tags = [t for t in self.flickrwrapper.getTags(remote_photo.photo_id)
+					if not parse_checksum_tag(t) and t != config.tag]
+			self.flickrwrapper.setTags(remote_photo.photo_id,
+					tags + self._compileTags(config).split())
+
+	def rename(self, config, title):
+		"""Rename the local file to title, keeping its content.
+		"""
+		src = os.path.join(self.path, self.title)
+		dst = os.path.join(self.path, title)
+		updateStatus('Renaming local: "{}" to "{}"'.format(src, dst))
+		if not config.dryrun:
+			# A resumed sync may have renamed it already.
+			if not os.path.exists(src) and os.path.exists(dst):
+				return
+			if os.path.exists(dst):
+				raise SyncError('Not renaming over existing file: ' + dst)
+			logger.info('Renaming local "{}" to "{}"'.format(src, dst))
+			os.rename(src, dst)
+			if self.cache:
+				self.cache.rename(self.title, title)
 
 
 class RemotePhoto(_Photo):
 	"""A Photo in a Flickr album."""
-	def __init__(self, flickrwrapper, title, photo_id, tags):
+	def __init__(self, flickrwrapper, title, photo_id, tags, url=''):
 		"""Create a wrapper object for a flickr photo. Args:
 
 		flickrwrapper - FlickrWrapper API object.
 		title - title of the photo
 		photo_id - the Flickr ID of the photo
 		tags - formatted python list (not the Flickr format of space-delimited string).
+		url - URL of the original image, if the album listing provided it. (Optional)
 		"""
 		logger.info('New remote photo: title={}, id={} tags={}'.format(title, photo_id, tags))
 		self.flickrwrapper = flickrwrapper
 		self.title = title
 		self.photo_id = photo_id
 		self.tags = tags
+		self.url = url
 
 	def __eq__(self, other):
 		"""Required for sorting.
@@ -166,6 +385,23 @@ class RemotePhoto(_Photo):
 				return checksum
 		return ''
 
+	def addChecksumTag(self, config, checksum):
+		"""Tags the photo with a checksum. Returns nothing.
+		"""
+		updateStatus('Tagging with checksum: ' + self.title)
+		if not config.dryrun:
+			tag = createChecksumTag(checksum)
+			self.flickrwrapper.addTags(self.photo_id, tag)
+			self.tags.append(tag)
+
+	def rename(self, config, title):
+		"""Changes the photo's title on Flickr. Returns nothing.
+		"""
+		updateStatus('Renaming in album: "{}" to "{}"'.format(self.title, title))
+		if not config.dryrun:
+			logger.info('Renaming photo {} to "{}"'.format(self.photo_id, title))
+			self.flickrwrapper.setTitle(self.photo_id, title)
+
 	def transfer(self, config):
 		"""Downloads the photo content to the local filesystem. Output file is config.path
 		with the photo title as the filename. Returns nothing.
@@ -174,9 +410,17 @@ class RemotePhoto(_Photo):
 		if not config.dryrun:
 			output_path = os.path.join(config.path, self.title)
 			logger.debug('Downloading to "{}"'.format(output_path))
-			photo_content = self.flickrwrapper.download(self.photo_id)
-			with open(output_path, 'wb') as f:
-				f.write(photo_content)
+			self.flickrwrapper.download(self.photo_id, output_path, config.fsync, self.url)
+
+	def transferredBytes(self, config):
+		"""Returns the size in bytes of the downloaded file, or None if nothing was downloaded.
+		"""
+		if config.dryrun:
+			return None
+		try:
+			return os.path.getsize(os.path.join(config.path, self.title))
+		except FileNotFoundError:
+			return None
 
 
 class MismatchedPhoto():
@@ -184,11 +428,176 @@ class MismatchedPhoto():
 	def __init__(self, local_photo, remote_photo):
 		self.local_photo = local_photo
 		self.remote_photo = remote_photo
+		# Both photos have the same title. Replacing keeps the remote photo's id.
+		self.title = local_photo.title
+		self.photo_id = remote_photo.photo_id
+
+	def replace(self, config):
+		"""Replace the remote photo's content with the local photo's.
+		"""
+		self.local_photo.replace(config, self.remote_photo)
+
+	def backfill(self, config):
+		"""Tag the remote photo with the local photo's checksum, trusting their content matches.
+		"""
+		self.remote_photo.addChecksumTag(config, self.local_photo.checksum())
 
 	def __repr__(self):
 		return '({},{})'.format(self.local_photo, self.remote_photo)
 
 
+class AlbumBatch():
+	"""Uploaded photos waiting to be added to the album, which are handed off together once
+	there are enough of them. They're added by the batch's own threads, one API call per photo,
+	in parallel and without holding up the upload workers. A photo only counts as transferred
+	once it's in the album, so done(photo) is deferred until then.
+	"""
+	def __init__(self, config, flickrwrapper, size, done=None, workers=1):
+		self.config = config
+		self.flickrwrapper = flickrwrapper
+		self.size = size
+		self.on_done = done
+		self.lock = threading.Lock()
+		self.pending = []
+		self.batched = set()
+		self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+		self.futures = []
+
+	def add(self, photo):
+		"""Queues a photo for the album, and hands off the queued photos if there are enough.
+		"""
+		with self.lock:
+			if photo.photo_id in self.batched:
+				return
+			self.pending.append(photo)
+			self.batched.add(photo.photo_id)
+			photos = []
+			if len(self.pending) >= self.size:
+				photos, self.pending = self.pending, []
+		# The API calls are made outside of the lock, other workers can queue meanwhile.
+		self._submit(photos)
+
+	def done(self, photo):
+		"""Passed to withRetries() in place of done(photo). Photos that were queued are done
+		when they're added to the album instead.
+		"""
+		if self.on_done and photo.photo_id not in self.batched:
+			self.on_done(photo)
+
+	def finish(self):
+		"""Adds the photos still queued, and waits until all the photos are in the album.
+		Returns the list of errors.
+		"""
+		with self.lock:
+			photos, self.pending = self.pending, []
+		self._submit(photos)
+		try:
+			return [f.result() for f in self.futures]
+		finally:
+			self.executor.shutdown()
+
+	def _submit(self, photos):
+		if not photos:
+			return
+		updateStatus('Adding {} photos to album: {}'.format(len(photos), self.config.album))
+		futures = [self.executor.submit(withRetries, self.config, p, p.addToAlbum, self.on_done)
+				for p in photos]
+		with self.lock:
+			self.futures += futures
+
+
+class UploadTickets():
+	"""Photos uploaded asynchronously that Flickr may still be processing, by ticket id.
+	"""
+	def __init__(self, flickrwrapper, uploaded=None):
+		self.flickrwrapper = flickrwrapper
+		# Called with each photo Flickr processed, as soon as its photo_id is known.
+		self.uploaded = uploaded
+		self.lock = threading.Lock()
+		self.pending = {}
+		self.titles = set()
+
+	def add(self, photo, ticket_id):
+		with self.lock:
+			self.pending[ticket_id] = photo
+			self.titles.add(photo.title)
+
+	def isPending(self, photo):
+		"""Returns whether the photo was uploaded asynchronously and is waiting on its ticket.
+		"""
+		with self.lock:
+			return photo.photo_id is None and photo.title in self.titles
+
+	def wait(self, config):
+		"""Polls the pending tickets until they all resolve, checking them in batches. Sets
+		the photo_id of the photos that Flickr processed. Returns (processed photos, SyncErrors
+		for the photos that failed).
+		"""
+		processed = []
+		errors = []
+		failures = 0
+		deadline = time.monotonic() + UPLOAD_TICKET_TIMEOUT
+		while self.pending:
+			try:
+				results = self.flickrwrapper.checkTickets(list(self.pending))
+				failures = 0
+			except Exception as err:
+				if not isServiceError(err):
+					raise
+				if not isTransientError(err) or failures == config.retries:
+					# Flickr may still process the uploads, a resumed sync checks them again.
+					for photo in self.pending.values():
+						errors.append(SyncError('{}: could not check the upload: {}'.format(
+								photo.title, err)))
+					break
+				failures += 1
+				logger.warning('Transient error checking upload tickets: {}'.format(err))
+				results = {}
+
+			for ticket_id, photo_id in results.items():
+				photo = self.pending.pop(ticket_id)
+				if photo_id is None:
+					errors.append(SyncError('{}: Flickr failed to process the upload'.format(
+							photo.title)))
+				else:
+					photo.photo_id = photo_id
+					if self.uploaded:
+						self.uploaded(photo)
+					processed.append(photo)
+
+			if not self.pending:
+				break
+			if time.monotonic() > deadline:
+				for photo in self.pending.values():
+					errors.append(SyncError('{}: Flickr is still processing the upload'.format(
+							photo.title)))
+				break
+			updateStatus('Waiting for Flickr to process {} uploads'.format(len(self.pending)))
+			time.sleep(UPLOAD_TICKET_POLL_INTERVAL)
+		return processed, errors
+
+
+class RenamedPhoto():
+	"""A LocalPhoto and RemotePhoto with the same content under different titles, ie. a photo
+	that was renamed on one side."""
+	def __init__(self, local_photo, remote_photo):
+		self.local_photo = local_photo
+		self.remote_photo = remote_photo
+		self.title = local_photo.title
+		self.photo_id = remote_photo.photo_id
+
+	def rename(self, config):
+		"""Rename the destination photo to the source photo's title.
+		"""
+		if config.push:
+			self.remote_photo.rename(config, self.local_photo.title)
+		else:
+			self.local_photo.rename(config, self.remote_photo.title)
+
+	def __repr__(self):
+		return '({}~{})'.format(self.local_photo, self.remote_photo)
+
+
 def filterRemote(photos):
 	return list(map(lambda p: p.remote_photo, photos))
 
@@ -197,6 +606,13 @@ def filterLocal(photos):
 	return list(map(lambda p: p.local_photo, photos))
 
 
+def listedTags(listing):
+	"""Returns the tags of a photo in an album listing as a list: its normalized tags followed by
+	its machine tags in their original form.
+	"""
+	return listing['tags'].split(' ') + listing.get('machine_tags', '').split()
+
+
 def loadRemotePhotos(config, flickrwrapper):
 	"""Get the photos in the album. If album_id isn't set (because the album might be created
 	later), returns an empty list.
@@ -204,9 +620,14 @@ def loadRemotePhotos(config, flickrwrapper):
 	if not config.album_id:
 		return []
 
-	album_listing = flickrwrapper.listAlbum(config.album_id)
+	album_listing = RemoteCatalog(config.dir_, config.album_id).list(flickrwrapper, config.refresh)
+	# Photos whose titles the local file filters leave out are out of the sync's scope, or a
+	# push would see them as remote only.
+	matches = nameFilter(config)
+	album_listing = [p for p in album_listing if matches(p['title'])]
 	# Convert the JSON responses to RemotePhoto object.
-	photos = map(lambda p: RemotePhoto(flickrwrapper, p['title'], p['id'], p['tags'].split(' ')), album_listing)
+	photos = map(lambda p: RemotePhoto(flickrwrapper, p['title'], p['id'], listedTags(p),
+			p.get('url_o', '')), album_listing)
 
 	# If a tag is specified, filter on only those photos.
 	if config.tag:
@@ -216,24 +637,59 @@ def loadRemotePhotos(config, flickrwrapper):
 	return photos
 
 
-def loadLocalPhotos(config, flickrwrapper):
-	"""Takes a Confg and FlickrWrapper and returns a list of LocalPhotos corresponding to the
-	config.
+def loadLocalPhotos(config, flickrwrapper, cache=None):
+	"""Takes a Confg and FlickrWrapper and yields the LocalPhotos corresponding to the config,
+	in directory order. The LocalPhotos share the optional LocalCache.
+	"""
+	count = 0
+	for name, st in scanLocalFiles(config.path, nameFilter(config)):
+		count += 1
+		yield LocalPhoto(flickrwrapper, name, config.path, cache, st)
+	logger.info('Found {} local files in "{}"'.format(count, config.path))
+
+
+def scanLocalFiles(path, matches=None):
+	"""Yields (name, stat result) for each file directly in path whose name satisfies
+	matches(name), in directory order. Names are filtered before anything about the file is
+	read, and the directory listing's own file type and stat are used where the OS provides
+	them.
 	"""
 	try:
-		# os.listdir ordering is not guaranteed, sort it because that's probably what users expect.
-		dir_listing = sorted(os.listdir(config.path))
+		entries = os.scandir(path)
 	except FileNotFoundError:
-		raise SyncError('Local path not found: ' + config.path)
-
-	# Filter only the files.
-	# TODO: Recursively traverse sub-dirs?
-	local_files = list(filter(lambda f: os.path.isfile(os.path.join(config.path, f)), dir_listing))
-	logger.info('Local files: ' + str(local_files))
+		raise SyncError('Local path not found: ' + path)
+	with entries:
+		for entry in entries:
+			# Leftovers of interrupted downloads aren't photos.
+			if entry.name.startswith(PARTIAL_DOWNLOAD_PREFIX):
+				continue
+			if matches and not matches(entry.name):
+				continue
+			try:
+				if not entry.is_file():
+					continue
+				st = entry.stat()
+			except FileNotFoundError:
+				# Removed since it was listed.
+				continue
+			yield entry.name, st
+
+
+def nameFilter(config):
+	"""Returns a function of a file name that returns whether the name passes the config's
+	include and exclude glob patterns and extensions allowlist.
+	"""
+	extensions = None
+	if config.extensions:
+		extensions = {'.' + e.lower().lstrip('.') for e in config.extensions}
 
-	# Wrap each file in a LocalPhoto.
-	photos = map(lambda f: LocalPhoto(flickrwrapper, f, config.path), local_files)
-	return photos
+	def matches(name):
+		if extensions is not None and os.path.splitext(name)[1].lower() not in extensions:
+			return False
+		if config.include and not any(fnmatch.fnmatch(name, p) for p in config.include):
+			return False
+		return not any(fnmatch.fnmatch(name, p) for p in config.exclude or [])
+	return matches
 
 
 def createChecksumTag(checksum):
@@ -241,37 +697,257 @@ def createChecksumTag(checksum):
 
 
 def parse_checksum_tag(tag):
+	"""Returns the checksum in a checksum tag, or empty string if it isn't one. Accepts the tag
+	as it was set (a machine tag) and as Flickr normalizes it in "tags" listings.
+	"""
 	checksum = ''
 	if tag.startswith(CHECKSUM_TAG_PREFIX):
 		checksum = tag[len(CHECKSUM_TAG_PREFIX):]
+	elif tag.startswith(CHECKSUM_TAG_PREFIX_NORMALIZED):
+		checksum = tag[len(CHECKSUM_TAG_PREFIX_NORMALIZED):]
 	return checksum
 
 
-def deletePhotos(config, photos):
-	for p in photos:
-		p.delete(config)
+def deletePhotos(config, photos, done=None):
+	"""Delete a list of photos. Skip failures and raise an exception at the end. done(photo) is
+	called after each successful deletion.
+	"""
+	errors = [withRetries(config, p, p.delete, done) for p in photos]
+	errors = [e for e in errors if e]
+	if errors:
+		raise SyncError(str(errors))
 
 
-def transferPhotos(config, photos):
-	"""Transfer a list of photos. Skip failures and raise an exception at the end.
+def runParallel(func, items, workers):
+	"""Calls func on each item using up to workers threads. Returns the results in the order of
+	items. If a call raises an exception the calls that haven't started are cancelled and the
+	exception is re-raised.
 	"""
-	errors = []
-	for p in photos:
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = [executor.submit(func, i) for i in items]
+		try:
+			return [f.result() for f in futures]
+		except BaseException:
+			for f in futures:
+				f.cancel()
+			raise
+
+
+def withRetries(config, photo, action, done=None):
+	"""Calls action(config), an operation on photo, then done(photo) if it succeeded. Transient
+	errors are retried up to config.retries times with jittered exponential backoff. Returns the
+	SyncError it finally failed with, naming the photo, or None on success. Errors other than
+	Flickr's and the network's are bugs, they're raised.
+	"""
+	for attempt in range(config.retries + 1):
 		try:
-			p.transfer(config)
+			action(config)
+			if done:
+				done(photo)
+			return None
 		except SyncError as err:
-			errors.append(err)
+			logger.error('Failed on "{}": {}'.format(photo.title, err))
+			return SyncError('{}: {}'.format(photo.title, err))
+		except Exception as err:
+			if not isServiceError(err):
+				raise
+			if not isTransientError(err):
+				logger.error('Failed on "{}": {}'.format(photo.title, err))
+				return SyncError('{}: {}'.format(photo.title, err))
+			if attempt == config.retries:
+				logger.error('Giving up on "{}" after {} attempts: {}'.format(photo.title,
+						attempt + 1, err))
+				return SyncError('{}: failed {} times, last error: {}'.format(photo.title,
+						attempt + 1, err))
+			# Full jitter keeps parallel workers that failed together from retrying together.
+			delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+			logger.warning('Transient error on "{}", retrying in {:.1f}s: {}'.format(
+					photo.title, delay, err))
+			time.sleep(delay)
+
+
+def transferPhoto(config, photo, done=None, limit=None, uploaded=None):
+	"""Transfer a photo, within the AdaptiveLimit limit if it's set. Returns the SyncError it
+	failed with, naming the photo, or None on success.
+	"""
+	action = photo.transfer
+	if uploaded and isinstance(photo, LocalPhoto):
+		action = lambda c: photo.transfer(c, uploaded=uploaded)
+	return withRetries(config, photo, limitedBy(limit, action, photo.transferredBytes), done)
+
+
+def limitedBy(limit, action, size=None):
+	"""Wraps action(config) so each call waits for a slot of the AdaptiveLimit limit, and
+	reports whether it failed with a sign of congestion. If size is set, size(config) returns
+	the bytes a successful call transferred, which the limit judges its time by. Returns action
+	as is if limit is None.
+	"""
+	if limit is None:
+		return action
+
+	def limited(config):
+		started = limit.acquire()
+		try:
+			action(config)
+		except Exception as err:
+			limit.release(started, congested=isTransientError(err))
+			raise
+		limit.release(started, size=size(config) if size else None)
+	return limited
+
+
+def adaptiveLimit(flickrwrapper, kind, maximum):
+	"""Returns the AdaptiveLimit of the kind of transfer, "upload" or "download". Each kind
+	talks to its own Flickr host, so each finds its own level. The level carries over between
+	steps and syncs that share the FlickrWrapper.
+	"""
+	return flickrwrapper.transfer_limits.setdefault(kind, AdaptiveLimit(maximum))
+
+
+def transferPhotos(config, photos, done=None, uploaded=None):
+	"""Transfer a list of photos. Skip failures and raise an exception at the end. done(photo) is
+	called after each successful transfer. uploaded(photo) is called as soon as Flickr returns
+	the id or upload ticket of an uploaded LocalPhoto, before it's in the album.
+	"""
+	photos = list(photos)
+	errors = []
+	workers = 1
+	if photos and isinstance(photos[0], LocalPhoto):
+		workers = config.upload_workers
+		# An upload creates the album if it doesn't exist yet. Upload one photo at a time until
+		# the album exists, so parallel uploads don't each create their own copy of the album.
+		while photos and not config.album_id:
+			errors.append(transferPhoto(config, photos.pop(0), done, uploaded=uploaded))
+	elif photos and isinstance(photos[0], RemotePhoto):
+		workers = config.download_workers
+		# Photos in an album can share a title, and so a local filename. Downloading them in
+		# parallel would interleave their writes, so keep only the last one, which is what
+		# downloading them in order would have left behind.
+		by_title = {p.title : p for p in photos}
+		if len(by_title) < len(photos):
+			logger.warning('Album has {} photos with duplicate titles, downloading one of each'
+					.format(len(photos) - len(by_title)))
+			photos = list(by_title.values())
+
+	# With adaptive workers, the worker count is the maximum that may run at once.
+	limit = None
+	if photos and config.adaptive_workers:
+		kind = 'upload' if isinstance(photos[0], LocalPhoto) else 'download'
+		limit = adaptiveLimit(photos[0].flickrwrapper, kind, workers)
+
+	if photos and isinstance(photos[0], LocalPhoto) and (config.album_batch or
+			config.async_uploads):
+		errors += uploadPhotos(config, photos, workers, done, limit, uploaded)
+	else:
+		errors += runParallel(lambda p: transferPhoto(config, p, done, limit, uploaded), photos,
+				workers)
+	errors = [e for e in errors if e]
+	if errors:
+		raise SyncError(str(errors))
+
+
+def uploadPhotos(config, photos, workers, done=None, limit=None, uploaded=None):
+	"""Uploads LocalPhotos in parallel, with their album membership batched and the uploads
+	asynchronous per config. done(photo) is called once a photo is in the album, uploaded(photo)
+	once Flickr returns its id or ticket. The uploads run within the AdaptiveLimit limit if it's
+	set. Returns the list of errors.
+	"""
+	flickrwrapper = photos[0].flickrwrapper
+	batch = None
+	album_done = done
+	if config.album_batch:
+		# Uploads only create the photos, they're added to the album in batches.
+		batch = AlbumBatch(config, flickrwrapper, config.album_batch, done, workers)
+		album_done = batch.done
+	tickets = UploadTickets(flickrwrapper, uploaded) if config.async_uploads else None
+
+	def transferred(p):
+		# An asynchronous upload isn't done until its ticket resolves.
+		if album_done and not (tickets and tickets.isPending(p)):
+			album_done(p)
+
+	def upload(p):
+		action = lambda c: p.transfer(c, batch, tickets, uploaded)
+		return withRetries(config, p, limitedBy(limit, action, p.transferredBytes), transferred)
+
+	errors = runParallel(upload, photos, workers)
+	if tickets:
+		processed, failed = tickets.wait(config)
+		errors += failed
+		errors += runParallel(lambda p: withRetries(config, p,
+				lambda c: p.finishUpload(c, batch), album_done), processed, workers)
+	if batch:
+		errors += batch.finish()
+	return errors
+
+
+def backfillChecksums(config, photos, done=None):
+	"""Tags each MismatchedPhoto's remote photo with the checksum of its local photo, in
+	parallel. Skip failures and raise an exception at the end. done(photo) is called after each
+	successful tagging.
+	"""
+	errors = runParallel(lambda m: withRetries(config, m, m.backfill, done), photos,
+			config.upload_workers)
+	errors = [e for e in errors if e]
+	if errors:
+		raise SyncError(str(errors))
+
+
+def replacePhotos(config, photos, done=None):
+	"""Replace the remote content of a list of MismatchedPhotos, in parallel. Skip failures and
+	raise an exception at the end. done(photo) is called after each successful replacement.
+	"""
+	errors = runParallel(lambda m: withRetries(config, m, m.replace, done), photos,
+			config.upload_workers)
+	errors = [e for e in errors if e]
 	if errors:
 		raise SyncError(str(errors))
 
 
-def diffPhotos(local_photos, remote_photos):
+def renamePhotos(config, photos, done=None):
+	"""Rename the destination side of a list of RenamedPhotos. Skip failures and raise an
+	exception at the end. done(photo) is called after each successful rename.
+	"""
+	# Local renames are too cheap to be worth threads.
+	workers = config.upload_workers if config.push else 1
+	errors = runParallel(lambda r: withRetries(config, r, r.rename, done), photos, workers)
+	errors = [e for e in errors if e]
+	if errors:
+		raise SyncError(str(errors))
+
+
+def checksumPhotos(photos, workers=1):
+	"""Calculates the checksums of a list of photos using up to workers threads. hashlib releases
+	the GIL while hashing, so threads scale with the cores and disks available.
+
+	Returns a dict of title->checksum.
+	"""
+	checksums = runParallel(lambda p: p.checksum(), photos, workers)
+	return {p.title : c for p, c in zip(photos, checksums)}
+
+
+def classifyPhotos(config, photos):
+	"""Returns the LocalPhotos that are images, only images are uploaded. Files are sniffed in
+	parallel, with up to config.checksum_workers.
+	"""
+	mime_types = runParallel(lambda p: p.mimeType(), photos, config.checksum_workers)
+	images = []
+	for p, mime_type in zip(photos, mime_types):
+		if mime_type.startswith('image/'):
+			images.append(p)
+		else:
+			updateStatus('Skipping non-image: ' + os.path.join(p.path, p.title))
+	return images
+
+
+def diffPhotos(local_photos, remote_photos, workers=1):
 	"""Compares a set of LocalPhotos to a set of RemotePhotos and returns the sets that are unique
 	and mismatched.
 
 	Args:
 	  local_photos  - dict of LocalPhotos, title->LocalPhoto
 	  remote_photos - list of RemotePhotos
+	  workers       - number of threads to calculate local checksums with
 
 	Returns:
 	  A tuple (local_only, remote_only, mismatched), where:
@@ -289,12 +965,18 @@ def diffPhotos(local_photos, remote_photos):
 	# Convert local photos to a dict for random access and use it as the set of local only photos.
 	# The dict keeps the original photo objects as the values.
 	local_only = {p.title : p for p in local_photos}
+	remote_photos = list(remote_photos)
+
+	# Hash every overlapping local photo up front so it can be done in parallel.
+	overlapping = {p.title : local_only[p.title] for p in remote_photos if p.title in local_only}
+	local_checksums = checksumPhotos(list(overlapping.values()), workers)
+
 	remote_only = []
 	mismatched = []
 	for p in remote_photos:
 		if p.title in local_only:
 			remote_checksum = p.checksum()
-			local_checksum = local_only[p.title].checksum()
+			local_checksum = local_checksums[p.title]
 			if remote_checksum != local_checksum:
 				logger.info('Mismatched checksums on "{}": local={}, remote={}'.format(
 						p.title, local_checksum, remote_checksum))
@@ -312,6 +994,70 @@ def diffPhotos(local_photos, remote_photos):
 	return (local_only, remote_only, mismatched)
 
 
+def matchRenames(local_only, remote_only, workers=1):
+	"""Pairs up local-only and remote-only photos with the same checksum, which are the same
+	photo renamed on one side. Remote photos without a checksum can't be matched. Local
+	checksums are calculated using up to workers threads.
+
+	Returns a tuple (renamed, local_only, remote_only) of the RenamedPhotos and the photos left
+	unmatched.
+	"""
+	remote_by_checksum = {}
+	for p in remote_only:
+		checksum = p.checksum()
+		if checksum:
+			remote_by_checksum.setdefault(checksum, p)
+	# Don't hash anything if nothing could match.
+	if not remote_by_checksum:
+		return [], local_only, remote_only
+
+	local_checksums = checksumPhotos(local_only, workers)
+	renamed = []
+	for p in local_only:
+		remote_photo = remote_by_checksum.pop(local_checksums[p.title], None)
+		if remote_photo:
+			renamed.append(RenamedPhoto(p, remote_photo))
+
+	renamed_titles = {r.local_photo.title for r in renamed}
+	renamed_ids = {r.remote_photo.photo_id for r in renamed}
+	local_only = [p for p in local_only if p.title not in renamed_titles]
+	remote_only = [p for p in remote_only if p.photo_id not in renamed_ids]
+	logger.info('Renamed content: ' + str(renamed))
+	return (renamed, local_only, remote_only)
+
+
+def findDuplicates(config, flickrwrapper, local_only, remote_only, remote_photos):
+	"""Sets duplicate_of on each local-only LocalPhoto whose checksum matches a photo elsewhere
+	in the Flickr account, so it's added to the album instead of uploaded.
+
+	A file whose checksum matches a photo already in the album was added by an earlier push,
+	under that photo's title. It's present, so it's dropped from local_only and the photo from
+	remote_only, instead of being uploaded again or the photo renamed in every album it's in.
+
+	Returns a tuple (local_only, remote_only) of the photos left.
+	"""
+	checksums = checksumPhotos(local_only, config.checksum_workers)
+	album = {p.checksum() : p.photo_id for p in remote_photos if p.checksum()}
+	present_ids = {album[checksums[p.title]] for p in local_only if checksums[p.title] in album}
+	local_only = [p for p in local_only if checksums[p.title] not in album]
+	remote_only = [p for p in remote_only if p.photo_id not in present_ids]
+	if not local_only:
+		return local_only, remote_only
+
+	index = ChecksumIndex(config.dir_).load(flickrwrapper, config.refresh)
+	# A photo already in the album is there under another title, adding it again does nothing.
+	album_ids = {p.photo_id for p in remote_photos}
+	duplicates = 0
+	for p in local_only:
+		photo_id = index.get(checksums[p.title])
+		if photo_id and photo_id not in album_ids:
+			p.duplicate_of = photo_id
+			duplicates += 1
+	logger.info('{} of {} local only photos are already in the account'.format(duplicates,
+			len(local_only)))
+	return local_only, remote_only
+
+
 def sync(config, flickrwrapper):
 	"""Synchronizes content from the source to the destination, using the necessary upload,
 	download, and delete operations per the settings in config.
@@ -322,28 +1068,267 @@ def sync(config, flickrwrapper):
 	# Validate the config first before acting on data. Inconsistent config could damage data.
 	config.validate()
 
-	local_photos = loadLocalPhotos(config, flickrwrapper)
-	remote_photos = loadRemotePhotos(config, flickrwrapper)
+	try:
+		if config.tree:
+			syncTree(config, flickrwrapper)
+		else:
+			syncPhotos(config, flickrwrapper)
+	finally:
+		reportStats(flickrwrapper)
+
+
+def syncTree(config, flickrwrapper):
+	"""Does the work of sync() in tree mode. Each directory in the tree is synced with its own
+	album, up to album_workers at once. The albums share flickrwrapper, so its API rate limit,
+	bandwidth limits, and adaptive workers apply to all of them together. An album's failure
+	doesn't stop the others, a SyncError is raised at the end.
+	"""
+	# One listing of the account's albums instead of a search per album.
+	album_ids = flickrwrapper.listAlbums()
+	albums = treeAlbums(config, album_ids)
+
+	def syncAlbum(album):
+		name, path = album
+		album_config = copy.copy(config)
+		album_config.album, album_config.path, album_config.tree = name, path, False
+		album_config.album_id = album_ids.get(name)
+		if not os.path.isdir(path):
+			updateStatus('Creating directory "{}" for album "{}"'.format(path, name))
+			if config.dryrun:
+				return None
+			os.makedirs(path)
+		updateStatus('Syncing album "{}" with "{}"'.format(name, path))
+		try:
+			syncPhotos(album_config, flickrwrapper)
+		except SyncError as e:
+			logger.error('Album "{}" failed: {}'.format(name, e))
+			return '{}: {}'.format(name, e)
+		return None
+
+	errors = [e for e in runParallel(syncAlbum, albums, config.album_workers) if e]
+	if errors:
+		raise SyncError('{} of {} albums failed: {}'.format(len(errors), len(albums), errors))
 
-	local_only, remote_only, mismatched = diffPhotos(local_photos, remote_photos)
+
+def reportStats(flickrwrapper):
+	"""Outputs the number of API calls made, per method, and the levels that adaptive workers
+	settled on.
+	"""
+	counts = flickrwrapper.call_counts
+	summary = ', '.join('{}={}'.format(m, counts[m]) for m in sorted(counts))
+	msg = 'Flickr API calls: {} ({})'.format(sum(counts.values()), summary)
+	logger.info(msg)
+	updateStatus(msg)
+
+	for kind, limit in sorted(flickrwrapper.transfer_limits.items()):
+		msg = 'Adaptive {} workers: {} (peaked at {}, of at most {})'.format(kind, limit.limit,
+				limit.peak, limit.maximum)
+		logger.info(msg)
+		updateStatus(msg)
+
+
+def syncPhotos(config, flickrwrapper):
+	"""Does the work of sync() with a validated config. Returns the plan that was run and the
+	album listing it was made from, which is None if the plan was resumed.
+	"""
+	# Checksums of unchanged files are remembered between runs.
+	cache = LocalCache(config.dir_, config.path)
+	journal = Journal(config.dir_, config.album, config.path)
+
+	plan, remote_photos = None, None
+	if config.resume:
+		plan = resumePlan(config, flickrwrapper, cache, journal)
+	if plan is None:
+		plan, remote_photos = planSync(config, flickrwrapper, cache)
+		# Record the plan before acting on it, so the sync can be resumed if interrupted.
+		if not config.dryrun:
+			journal.start(config, [[action, [photoToDict(p) for p in photos]]
+					for action, photos in plan])
+
+	try:
+		runPlan(config, plan, journal)
+	finally:
+		# Renames and uploads update the cache.
+		cache.save()
+	if not config.dryrun:
+		journal.finish()
+	return plan, remote_photos
+
+
+def planSync(config, flickrwrapper, cache):
+	"""Lists and compares the local and remote photos. Returns the plan to sync them, a list of
+	(action, photos) steps to run in order, and the remote photos listed. The action is
+	"transfer", "delete", "replace", "rename", or "backfill".
+	"""
+	# Sorted because that's probably the upload order users expect.
+	local_photos = sorted(loadLocalPhotos(config, flickrwrapper, cache))
+	# Forget files that are gone from the cache.
+	cache.prune(p.title for p in local_photos)
+	listing = list(loadRemotePhotos(config, flickrwrapper))
+	remote_photos = listing
+
+	# Save even if hashing is interrupted, whatever was hashed so far is still valid.
+	try:
+		# Non-image files can't be uploaded, leave them out of the diff. So are photos with
+		# their titles, a sync would otherwise delete them.
+		if config.push:
+			images = classifyPhotos(config, local_photos)
+			skipped = {p.title for p in local_photos} - {p.title for p in images}
+			local_photos = images
+			remote_photos = [p for p in remote_photos if p.title not in skipped]
+		local_only, remote_only, mismatched = diffPhotos(local_photos, remote_photos,
+				config.checksum_workers)
+		# Before matching renames, photos added by dedupe are in the album under another title
+		# and may be in other albums too, they must not be renamed.
+		if config.push and config.dedupe and local_only:
+			local_only, remote_only = findDuplicates(config, flickrwrapper, local_only,
+					remote_only, remote_photos)
+		# A photo renamed on one side would otherwise be transferred again under its new title
+		# and deleted under its old one. Only a sync deletes the old title, so only a sync can
+		# rename it instead.
+		renamed = []
+		if config.checksum and config.sync:
+			renamed, local_only, remote_only = matchRenames(local_only, remote_only,
+					config.checksum_workers)
+	finally:
+		cache.save()
+
+	# Photos uploaded without checksums mismatch everything. Trust that they match their local
+	# counterpart and tag them with its checksum instead of transferring them again.
+	untagged = []
+	if config.checksum and config.backfill_checksums:
+		untagged = [m for m in mismatched if not m.remote_photo.checksum()]
+		mismatched = [m for m in mismatched if m.remote_photo.checksum()]
 
 	# Transfer and remove files to sync appropraitely per config. The diff of content overlapping
 	# between local, remote, and mismatched has been calculated. Three things that must happen:
 	# 1) Transfer the content exclusive to the source.
 	# 2) If checksum matching enabled, overwrite mismatching destination content from the source.
 	# 3) If sync is enabled, remove content exclusive to the destination.
+	plan = []
 	if config.push:
-		transferPhotos(config, local_only)
+		if renamed:
+			plan.append(('rename', renamed))
+		plan.append(('transfer', local_only))
+		# Replacing keeps the photo's id and album membership, and the album can't be emptied.
 		if config.checksum:
-			deletePhotos(config, filterRemote(mismatched))
-			transferPhotos(config, filterLocal(mismatched))
+			plan.append(('replace', mismatched))
 		if config.sync:
-			deletePhotos(config, remote_only)
+			plan.append(('delete', remote_only))
 
 	if config.pull:
-		transferPhotos(config, remote_only)
+		if renamed:
+			plan.append(('rename', renamed))
+		plan.append(('transfer', remote_only))
+		# Downloads replace the local file atomically, no need to delete it first.
 		if config.checksum:
-			deletePhotos(config, filterLocal(mismatched))
-			transferPhotos(config, filterRemote(mismatched))
+			plan.append(('transfer', filterRemote(mismatched)))
 		if config.sync:
-			deletePhotos(config, local_only)
+			plan.append(('delete', local_only))
+	# Last, a photo that fails to be tagged only mismatches again on the next sync. It doesn't
+	# hold up the transfers.
+	if untagged:
+		plan.append(('backfill', untagged))
+	return plan, listing
+
+
+def resumePlan(config, flickrwrapper, cache, journal):
+	"""Loads the plan of an interrupted sync from its journal, skipping the listing and diffing.
+	Returns None if there is nothing to resume.
+	"""
+	try:
+		steps = journal.load(config)
+	except ValueError as e:
+		raise SyncError('Cannot resume, {}. Run without --resume to start over.'.format(e))
+	if steps is None:
+		updateStatus('No interrupted sync to resume, starting over')
+		return None
+
+	config.album_id = journal.album_id
+	plan = [(action, [photoFromDict(d, config, flickrwrapper, cache) for d in photos])
+			for action, photos in steps]
+	# Uploads that completed before the interruption, but weren't in the album yet.
+	for step, (action, photos) in enumerate(plan):
+		for p in photos:
+			noted = journal.noted(step, photoKey(p))
+			if isinstance(p, LocalPhoto) and noted:
+				p.photo_id = noted.get('photo_id')
+				p.ticket_id = noted.get('ticket_id')
+				p.upload_checksum = noted.get('upload_checksum')
+	total = sum(len(photos) for _, photos in plan)
+	updateStatus('Resuming interrupted sync, {} of {} operations already done'.format(
+			len(journal.done), total))
+	return plan
+
+
+def runPlan(config, plan, journal):
+	"""Runs the steps of a plan in order, skipping operations the journal has as done and
+	recording the ones that complete.
+	"""
+	for step, (action, photos) in enumerate(plan):
+		photos = [p for p in photos if not journal.isDone(step, photoKey(p))]
+
+		def done(p, step=step):
+			if not config.dryrun:
+				journal.record(step, photoKey(p), album_id=config.album_id,
+						photo_id=p.photo_id)
+
+		# A resumed sync only adds uploaded photos to the album, instead of uploading them
+		# again.
+		def uploaded(p, step=step):
+			journal.note(step, photoKey(p), photo_id=p.photo_id, ticket_id=p.ticket_id,
+					upload_checksum=p.upload_checksum)
+
+		if action == 'transfer':
+			transferPhotos(config, photos, done, uploaded)
+		elif action == 'replace':
+			replacePhotos(config, photos, done)
+		elif action == 'rename':
+			renamePhotos(config, photos, done)
+		elif action == 'backfill':
+			backfillChecksums(config, photos, done)
+		else:
+			deletePhotos(config, photos, done)
+
+
+def photoKey(photo):
+	"""Identifies a photo within a step of a plan.
+	"""
+	if isinstance(photo, LocalPhoto):
+		return 'local:' + photo.title
+	if isinstance(photo, MismatchedPhoto):
+		return 'replace:{}'.format(photo.photo_id)
+	if isinstance(photo, RenamedPhoto):
+		return 'rename:{}'.format(photo.photo_id)
+	return 'remote:{}'.format(photo.photo_id)
+
+
+def photoToDict(photo):
+	"""Serializes a photo for the journal.
+	"""
+	if isinstance(photo, LocalPhoto):
+		return {'kind': 'local', 'title': photo.title, 'duplicate_of': photo.duplicate_of}
+	if isinstance(photo, MismatchedPhoto):
+		return {'kind': 'mismatched', 'local': photoToDict(photo.local_photo),
+				'remote': photoToDict(photo.remote_photo)}
+	if isinstance(photo, RenamedPhoto):
+		return {'kind': 'renamed', 'local': photoToDict(photo.local_photo),
+				'remote': photoToDict(photo.remote_photo)}
+	return {'kind': 'remote', 'title': photo.title, 'photo_id': photo.photo_id,
+			'tags': photo.tags, 'url': photo.url}
+
+
+def photoFromDict(d, config, flickrwrapper, cache):
+	"""Deserializes a photo from the journal.
+	"""
+	if d['kind'] == 'local':
+		photo = LocalPhoto(flickrwrapper, d['title'], config.path, cache)
+		photo.duplicate_of = d.get('duplicate_of')
+		return photo
+	if d['kind'] == 'mismatched':
+		return MismatchedPhoto(photoFromDict(d['local'], config, flickrwrapper, cache),
+				photoFromDict(d['remote'], config, flickrwrapper, cache))
+	if d['kind'] == 'renamed':
+		return RenamedPhoto(photoFromDict(d['local'], config, flickrwrapper, cache),
+				photoFromDict(d['remote'], config, flickrwrapper, cache))
+	return RemotePhoto(flickrwrapper, d['title'], d['photo_id'], d['tags'], d['url'])
@@ -0,0 +1,120 @@
+"""Rate limiting shared between threads."""
+import os
+import threading
+import time
+
+
+__all__ = ['AdaptiveLimit', 'ThrottledReader', 'TokenBucket']
+
+
+# An operation is only healthy if it took at most this many times as long as the fastest one
+# seen of a similar size. Slower operations mean the link is saturated, and the limit stops
+# growing.
+ADAPTIVE_LATENCY_TOLERANCE = 3
+
+
+class TokenBucket():
+	"""Limits a rate to rate units per second on average, with bursts of up to capacity units.
+	Safe to share between threads.
+	"""
+	def __init__(self, rate, capacity):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+		self.lock = threading.Lock()
+
+	def acquire(self, amount=1):
+		"""Blocks until amount units may be used. Units are reserved before waiting, so waiting
+		callers are served in order. An amount larger than capacity is allowed, it waits for the
+		bucket to refill from the debt it leaves behind.
+		"""
+		with self.lock:
+			now = time.monotonic()
+			self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			self.tokens -= amount
+			wait = -self.tokens / self.rate if self.tokens < 0 else 0
+		if wait > 0:
+			time.sleep(wait)
+
+
+class ThrottledReader():
+	"""Wraps a binary file so reading it is limited by a TokenBucket counting bytes. Has the
+	attributes that flickrapi's uploads need of a file object.
+	"""
+	def __init__(self, f, bucket):
+		self.file = f
+		self.bucket = bucket
+		self.len = os.fstat(f.fileno()).st_size
+		self.fileno = f.fileno
+		self.tell = f.tell
+
+	def read(self, size=-1):
+		data = self.file.read(size)
+		if data:
+			self.bucket.acquire(len(data))
+		return data
+
+
+class AdaptiveLimit():
+	"""Limits how many operations run at once, adapting the limit to how they fare (AIMD). The
+	limit grows by one after a limit's worth of healthy operations and halves when one fails
+	with a sign of congestion, like a timeout or a 429 or 5xx response. Operations are compared
+	with the fastest one of a similar size, within a factor of two, so a small file doesn't
+	make every large one look slow. Safe to share between threads.
+	"""
+	def __init__(self, maximum, initial=1):
+		self.maximum = maximum
+		self.limit = min(initial, maximum)
+		self.peak = self.limit
+		self.active = 0
+		self.healthy = 0
+		# Size class -> fastest latency seen, see sizeClass().
+		self.min_latencies = {}
+		self.decreased_at = time.monotonic()
+		self.cond = threading.Condition()
+
+	def acquire(self):
+		"""Blocks until another operation may start. Returns its start time, to pass to
+		release().
+		"""
+		with self.cond:
+			while self.active >= self.limit:
+				self.cond.wait()
+			self.active += 1
+		return time.monotonic()
+
+	def release(self, started, congested=False, size=None):
+		"""Ends an operation that started at started, and adapts the limit to its outcome. size
+		is the number of bytes it transferred, if known.
+		"""
+		now = time.monotonic()
+		with self.cond:
+			self.active -= 1
+			if congested:
+				# Operations that were already running when the limit was cut all see the same
+				# congestion, only cut it once for them.
+				if started >= self.decreased_at:
+					self.limit = max(1, self.limit // 2)
+					self.healthy = 0
+					self.decreased_at = now
+			else:
+				latency = now - started
+				size_class = sizeClass(size)
+				min_latency = min(latency, self.min_latencies.get(size_class, latency))
+				self.min_latencies[size_class] = min_latency
+				if latency <= ADAPTIVE_LATENCY_TOLERANCE * min_latency:
+					self.healthy += 1
+					if self.healthy >= self.limit and self.limit < self.maximum:
+						self.limit += 1
+						self.peak = max(self.peak, self.limit)
+						self.healthy = 0
+			self.cond.notify_all()
+
+
+def sizeClass(size):
+	"""Returns the class of sizes that size, in bytes, is compared within: sizes within a factor
+	of two of each other. None if the size isn't known.
+	"""
+	return None if size is None else size.bit_length()
@@ -0,0 +1,68 @@
+"""Tree mode: maps the subdirectories of a local path to albums, one album per directory."""
+import logging
+import os
+import re
+
+from .general import SyncError
+
+
+__all__ = ['TREE_DIR_PLACEHOLDER', 'treeAlbums']
+logger = logging.getLogger(__name__)
+
+
+# Stands for a subdirectory's path in the album name template.
+TREE_DIR_PLACEHOLDER = '{dir}'
+
+
+def albumName(template, rel_dir):
+	"""Returns the name of the album for the directory rel_dir, relative to the tree's root.
+	"""
+	return template.replace(TREE_DIR_PLACEHOLDER, rel_dir)
+
+
+def albumDir(template, album_name):
+	"""Returns the directory, relative to the tree's root, that the album maps to. Returns None
+	if the album's name doesn't match the template, or it would map outside of the tree.
+	"""
+	prefix, suffix = template.split(TREE_DIR_PLACEHOLDER)
+	match = re.fullmatch(re.escape(prefix) + '(.+)' + re.escape(suffix), album_name)
+	if not match:
+		return None
+	rel_dir = match.group(1)
+	# Album names come from Flickr, don't let one like "../x" write outside of the tree.
+	parts = rel_dir.split('/')
+	if any(not part or part.startswith('.') or '\\' in part for part in parts):
+		logger.warning('Ignoring album "{}", it doesn\'t map to a directory in the tree'.format(
+				album_name))
+		return None
+	return rel_dir
+
+
+def listTreeDirs(root):
+	"""Yields the path of each directory under root, recursively, relative to root and with "/"
+	separators. Hidden directories, and everything under them, are skipped. Symlinks to
+	directories aren't followed, one to an ancestor would recurse forever.
+	"""
+	try:
+		entries = sorted(os.scandir(root), key=lambda e: e.name)
+	except FileNotFoundError:
+		raise SyncError('Local path not found: ' + root)
+	for entry in entries:
+		if entry.name.startswith('.') or not entry.is_dir(follow_symlinks=False):
+			continue
+		yield entry.name
+		for rel_dir in listTreeDirs(entry.path):
+			yield entry.name + '/' + rel_dir
+
+
+def treeAlbums(config, albums):
+	"""Takes a Config in tree mode and a dict of the account's album name->ID. Returns a list of
+	(album name, local path) for each directory in the tree, sorted by path. With pull, albums
+	whose name matches the template are included even if their directory doesn't exist yet.
+	"""
+	rel_dirs = set(listTreeDirs(config.path))
+	if config.pull:
+		rel_dirs.update(d for d in map(lambda a: albumDir(config.album, a), albums) if d)
+	logger.info('Tree "{}" has {} albums'.format(config.path, len(rel_dirs)))
+	return [(albumName(config.album, d), os.path.join(config.path, *d.split('/')))
+			for d in sorted(rel_dirs)]
@@ -0,0 +1,268 @@
+"""Watch mode: pushes local files to the album as they're added or changed."""
+import logging
+import os
+import stat
+import time
+
+from .cache import fileIdentity
+from .cache import LocalCache
+from .flickrwrapper import isServiceError
+from .general import PARTIAL_DOWNLOAD_PREFIX
+from .general import SyncError
+from .status import updateStatus
+from .syncer import LocalPhoto
+from .syncer import MismatchedPhoto
+from .syncer import RemotePhoto
+from .syncer import classifyPhotos
+from .syncer import createChecksumTag
+from .syncer import loadRemotePhotos
+from .syncer import nameFilter
+from .syncer import replacePhotos
+from .syncer import reportStats
+from .syncer import scanLocalFiles
+from .syncer import syncPhotos
+from .syncer import transferPhotos
+
+try:
+	import inotify_simple
+except ImportError:
+	inotify_simple = None
+
+
+__all__ = ['watch']
+logger = logging.getLogger(__name__)
+
+
+# Seconds between checks for changes, and so for files that finished settling.
+WATCH_POLL_INTERVAL = 2
+
+# Seconds between full syncs while the album couldn't be listed, nothing is pushed until then.
+WATCH_RETRY_INTERVAL = 60
+
+
+def watch(config, flickrwrapper):
+	"""Pushes the files in config.path to the album as they're added or changed, until
+	interrupted. Starts with a full sync, and does another one every config.watch_reconcile
+	seconds to catch anything the watch missed, eg. deleted files with sync.
+
+	Returns nothing. Raises a SyncError on failure.
+	"""
+	logger.info(str(config))
+	config.validate()
+
+	watcher = Watcher(config, flickrwrapper)
+	try:
+		watcher.run()
+	except KeyboardInterrupt:
+		updateStatus('Stopped watching "{}"'.format(config.path))
+	finally:
+		watcher.cache.save()
+		reportStats(flickrwrapper)
+
+
+def newChangeSource(path, matches):
+	"""Returns the best available source of changed file names in path: inotify if the
+	inotify_simple package is installed, otherwise polling the directory.
+	"""
+	if inotify_simple:
+		try:
+			return InotifyChanges(path, matches)
+		except OSError as e:
+			logger.warning('Could not watch "{}" with inotify, polling instead: {}'.format(path,
+					e))
+	return PollingChanges(path, matches)
+
+
+class InotifyChanges():
+	"""Names of files in a directory that were written to or moved in, from inotify events.
+	"""
+	def __init__(self, path, matches):
+		self.matches = matches
+		self.inotify = inotify_simple.INotify()
+		flags = inotify_simple.flags
+		self.inotify.add_watch(path, flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE |
+				flags.MOVED_TO)
+
+	def wait(self, timeout):
+		"""Waits up to timeout seconds for changes. Returns the set of changed names.
+		"""
+		events = self.inotify.read(timeout=int(timeout * 1000))
+		return {e.name for e in events if e.name and
+				not e.name.startswith(PARTIAL_DOWNLOAD_PREFIX) and self.matches(e.name)}
+
+
+class PollingChanges():
+	"""Names of files in a directory that were added or changed, from comparing listings. Only
+	the directory is listed, nothing is read from the files.
+	"""
+	def __init__(self, path, matches):
+		self.path = path
+		self.matches = matches
+		self.identities = self._scan()
+
+	def _scan(self):
+		return {name : fileIdentity(st) for name, st in scanLocalFiles(self.path, self.matches)}
+
+	def wait(self, timeout):
+		"""Waits timeout seconds, then returns the set of names that changed since the last
+		call.
+		"""
+		time.sleep(timeout)
+		identities = self._scan()
+		changed = {n for n, i in identities.items() if self.identities.get(n) != i}
+		self.identities = identities
+		return changed
+
+
+class Watcher():
+	"""Pushes changed files once they've settled: not been modified for config.watch_settle
+	seconds, so files that are still being written aren't uploaded half-way. Files are compared
+	with the album listing from the last full sync, instead of listing the album again.
+	"""
+	def __init__(self, config, flickrwrapper, changes=None):
+		self.config = config
+		self.flickrwrapper = flickrwrapper
+		# Watch before the first sync, so files changed during it aren't missed.
+		self.changes = changes or newChangeSource(config.path, nameFilter(config))
+		self.cache = LocalCache(config.dir_, config.path)
+		# None until the album is listed.
+		self.remote = None
+		# Changed names -> [file identity, time it was first seen with that identity].
+		self.pending = {}
+		self.reconciled_at = None
+
+	def run(self):
+		"""Watches and pushes changes until interrupted.
+		"""
+		self.reconcile()
+		updateStatus('Watching "{}" for changes'.format(self.config.path))
+		while True:
+			self.step()
+
+	def step(self):
+		"""Waits for changes once and pushes the files that have settled. Does a full sync
+		instead if one is due.
+		"""
+		elapsed = time.monotonic() - self.reconciled_at
+		if self.config.watch_reconcile and elapsed >= self.config.watch_reconcile:
+			self.reconcile()
+		elif self.remote is None and elapsed >= WATCH_RETRY_INTERVAL:
+			self.reconcile()
+
+		for name in self.changes.wait(WATCH_POLL_INTERVAL):
+			self.pending.setdefault(name, [None, None])
+		# Without the album, every file would look new. Changes stay pending until it's listed.
+		if self.remote is None:
+			return
+		settled = self.settle()
+		if settled:
+			self.push(settled)
+
+	def reconcile(self):
+		"""Does a full sync, and updates the album that changes are compared with.
+		"""
+		updateStatus('Syncing "{}" in full'.format(self.config.path))
+		# The sync brings its own cache, save this one's entries before it's loaded.
+		self.cache.save()
+		try:
+			plan, remote_photos = syncPhotos(self.config, self.flickrwrapper)
+			# A resumed sync doesn't list the album.
+			if remote_photos is None:
+				remote_photos = loadRemotePhotos(self.config, self.flickrwrapper)
+				plan = []
+			self.remote = self.albumAfter(plan, remote_photos)
+		except Exception as e:
+			if not isinstance(e, SyncError) and not isServiceError(e):
+				raise
+			# Keep watching, the next sync will try again. The album may have changed before the
+			# sync failed, list it as it is now.
+			logger.error(e)
+			updateStatus('Sync failed: {}'.format(e))
+			self.remote = self.listAlbum()
+		self.cache = LocalCache(self.config.dir_, self.config.path)
+		self.reconciled_at = time.monotonic()
+
+	def listAlbum(self):
+		"""Returns the album as listed, a dict of title->RemotePhoto, or None if it can't be
+		listed.
+		"""
+		try:
+			return {p.title : p for p in loadRemotePhotos(self.config, self.flickrwrapper)}
+		except Exception as e:
+			if not isinstance(e, SyncError) and not isServiceError(e):
+				raise
+			logger.error('Could not list the album, not pushing changes until it is: {}'.format(e))
+			return None
+
+	def albumAfter(self, plan, remote_photos):
+		"""Returns the album after a sync ran plan, a dict of title->RemotePhoto, from the
+		listing the plan was made from.
+		"""
+		album = {p.title : p for p in remote_photos}
+		if not self.config.push or self.config.dryrun:
+			return album
+		for action, photos in plan:
+			for p in photos:
+				if action == 'delete':
+					album.pop(p.title, None)
+				elif action == 'rename':
+					remote = album.pop(p.remote_photo.title, p.remote_photo)
+					album[p.title] = RemotePhoto(self.flickrwrapper, p.title, remote.photo_id,
+							remote.tags)
+				elif p.photo_id is not None:
+					self.pushed(album, p)
+		return album
+
+	def pushed(self, album, p):
+		"""Adds a LocalPhoto or MismatchedPhoto that was just pushed to album.
+		"""
+		local = p.local_photo if isinstance(p, MismatchedPhoto) else p
+		tags = [createChecksumTag(local.checksum())] if self.config.checksum else []
+		album[p.title] = RemotePhoto(self.flickrwrapper, p.title, p.photo_id, tags)
+
+	def settle(self):
+		"""Returns the names of pending files that haven't changed for config.watch_settle
+		seconds, and stops tracking them. Vanished files are dropped.
+		"""
+		now = time.monotonic()
+		settled = []
+		for name, (identity, since) in list(self.pending.items()):
+			try:
+				st = os.stat(os.path.join(self.config.path, name))
+			except FileNotFoundError:
+				del self.pending[name]
+				continue
+			if not stat.S_ISREG(st.st_mode):
+				del self.pending[name]
+			elif fileIdentity(st) != identity:
+				self.pending[name] = [fileIdentity(st), now]
+			elif now - since >= self.config.watch_settle:
+				del self.pending[name]
+				settled.append(name)
+		return sorted(settled)
+
+	def push(self, names):
+		"""Uploads the named files that aren't in the album and, with checksum, replaces the
+		ones whose content changed.
+		"""
+		photos = [LocalPhoto(self.flickrwrapper, n, self.config.path, self.cache) for n in names]
+		photos = classifyPhotos(self.config, photos)
+		new = [p for p in photos if p.title not in self.remote]
+		changed = []
+		if self.config.checksum:
+			changed = [MismatchedPhoto(p, self.remote[p.title]) for p in photos
+					if p.title in self.remote and p.checksum() != self.remote[p.title].checksum()]
+		logger.info('{} files settled, {} new and {} changed'.format(len(photos), len(new),
+				len(changed)))
+
+		for action, photos in [(transferPhotos, new), (replacePhotos, changed)]:
+			if not photos:
+				continue
+			try:
+				action(self.config, photos, lambda p: self.pushed(self.remote, p))
+			except SyncError as e:
+				# Keep watching, failed files are pushed when they change again or by the next
+				# full sync.
+				logger.error(e)
+				updateStatus('Push failed: {}'.format(e))
+		self.cache.save()
@@ -24,6 +24,10 @@ setup(
     license = license,
     keywords = 'flickr sync upload download backup photo album photo pic',
     install_requires = install_req,
+    # Watch mode uses inotify if it's available, and polls otherwise.
+    extras_require = {
+        'watch': ['inotify_simple'],
+    },
     entry_points = {
         "console_scripts": [
             "flickrsyncr=flickrsyncr:cli",
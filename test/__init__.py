@@ -1,3 +1,5 @@
 import test.test_syncer
 import test.test_config
 import test.test_flickrwrapper
+import test.test_cache
+import test.test_throttle
@@ -1,4 +1,6 @@
+import io
 import random
+import time
 from xml.etree import ElementTree
 
 import flickrapi
@@ -30,16 +32,33 @@ class StubFlickrAPI():
 		def __init__(self):
 			self.albums = []
 			self.photos = {}
+			self.created = []
+			self.created_ids = []
+			self.listed = []
+			self.added = []
+			# Photo IDs that addPhoto() reports as not found, eg. because they were deleted.
+			self.missing_photos = set()
+			# Number of videos per album ID, getInfo() counts them apart from photos.
+			self.videos = {}
 
 		def getList(self, *args, page='', **kwargs):
 			"""Hard-coded results pages for listing albums. Result indexed by results page number.
 			"""
 			return self.albums[page-1]
 
-		def create(self, *args, **kwargs):
-			"""Create an album, always respond OK with a random album ID. Return a random album ID. Does not actually populate the stub data store, use stubAdd Album for that.
+		def create(self, *args, title='', primary_photo_id='', **kwargs):
+			"""Create an album, always respond OK with a random album ID. Return a random album ID. Logs the album names in self.created as a "spy" stub, use stubAddAlbum to populate the stub data store.
 			"""
+			self.created.append(title)
 			new_id = random.randint(1000, 10000)
+			self.created_ids.append(new_id)
+			# The album starts out with its cover photo.
+			self.photos[new_id] = [{
+				'photoset': {
+					'pages': 1,
+					'photo': [{'title': '', 'id': primary_photo_id, 'tags': ''}],
+				},
+			}]
 			result = {
 				'stat': 'ok',
 				'photoset': {
@@ -48,51 +67,190 @@ class StubFlickrAPI():
 			}
 			return result
 
+		def getInfo(self, photoset_id=''):
+			"""Album metadata. The update date changes whenever stubAddPhoto adds a photo.
+			"""
+			if photoset_id not in self.photos:
+				raise flickrapi.exceptions.FlickrError("album doesn't exist", code=1)
+			return {
+				'photoset': {
+					'id': photoset_id,
+					'date_update': str(len(self.photos[photoset_id])),
+					'photos': len(self.photos[photoset_id]),
+					'videos': self.videos.get(photoset_id, 0),
+				},
+			}
+
 		def getPhotos(self, *args, photoset_id='', page='', **kwargs):
-			"""Hard-coded results for an album list. Result indexed by album ID and page.
+			"""Hard-coded results for an album list. Result indexed by album ID and page. Logs
+			the album IDs listed in self.listed as a "spy" stub.
 			"""
+			self.listed.append(photoset_id)
 			return self.photos[photoset_id][page-1]
 
-		def addPhoto(self, photoset_id=None, **kwargs):
+		def addPhoto(self, photoset_id=None, photo_id=None, **kwargs):
+			"""Logs the (photoset_id, photo_id) added in self.added as a "spy" stub."""
+			if photo_id in self.missing_photos:
+				raise flickrapi.exceptions.FlickrError("photo doesn't exist", code=2)
+			self.added.append((photoset_id, photo_id))
 			for a in self.albums:
-				if a['photosets']['photoset'][0]['id']:
+				if photoset_id and a['photosets']['photoset'][0]['id'] == photoset_id:
 					return
+			# Albums created through the API exist from then on.
+			if photoset_id and photoset_id in self.created_ids:
+				return
 			raise flickrapi.exceptions.FlickrError("album doesn't exist", code=1)
 
+	class StubUploader():
+		"""Stub for attribute flickrapi.FlickrAPI().photos.upload. Serves the tickets of
+		asynchronous uploads, which are still processing the first time they're checked.
+		"""
+		def __init__(self):
+			self.tickets = {}
+			self.checked = []
+
+		def checkTickets(self, tickets=''):
+			"""Logs the tickets checked in self.checked as a "spy" stub."""
+			results = []
+			for ticket_id in tickets.split(','):
+				complete = 1 if any(ticket_id in c.split(',') for c in self.checked) else 0
+				results.append({'id': ticket_id, 'complete': complete,
+						'photoid': self.tickets[ticket_id]})
+			self.checked.append(tickets)
+			return {'uploader': {'ticket': results}}
+
 	class StubPhotos():
 		"""Stub for attribute flickrapi.FlickrAPI().photos. Populate the content it serves with
 		stubAddPhoto().
 		"""
-		def __init__(self):
+		def __init__(self, photosets):
+			self.photosets = photosets
+			self.upload = StubFlickrAPI.StubUploader()
 			self.sizes = {}
+			self.sizes_requested = []
+			self.updated = []
+			self.added_tags = []
+			self.set_tags = []
+			# Photo ID -> tags as they were set, otherwise getInfo() lists the seeded tags.
+			self.raw_tags = {}
+			# Photo ID -> upload date, in the order stubAddPhoto() seeded them.
+			self.upload_dates = {}
+			# Searches return at most this many photos, like Flickr.
+			self.search_limit = 4000
+			self.set_meta = []
+
+		def recentlyUpdated(self, min_date=0, **kwargs):
+			"""Photos changed by stubUpdatePhoto() since min_date, all on one page.
+			"""
+			return {
+				'photos': {
+					'pages': 1,
+					'photo': [p for p in self.updated if p['lastupdate'] >= min_date],
+				},
+			}
+
+		def search(self, machine_tags='', min_upload_date=0, max_upload_date=2**40, **kwargs):
+			"""Photos seeded in any album with a tag starting with machine_tags, which is
+			expected to be a machine tag query without a value, uploaded between the dates. All
+			on one page, cut off at self.search_limit.
+			"""
+			found = []
+			for pages in self.photosets.photos.values():
+				for page in pages:
+					for p in page['photoset']['photo']:
+						date = self.upload_dates.get(p['id'], 0)
+						if not min_upload_date <= date <= max_upload_date:
+							continue
+						tags = [t for t in p['tags'].split() if t.startswith(machine_tags)]
+						if tags:
+							found.append({'id': p['id'], 'machine_tags': ' '.join(tags)})
+			return {
+				'photos': {
+					'pages': 1,
+					'total': str(len(found)),
+					'photo': found[:self.search_limit],
+				},
+			}
 
 		def getSizes(self, photo_id=''):
+			"""Logs the requested photo IDs in self.sizes_requested as a "spy" stub."""
+			self.sizes_requested.append(photo_id)
 			return self.sizes[photo_id]
 
+		def addTags(self, photo_id='', tags=''):
+			"""Logs the tags added in self.added_tags as a "spy" stub."""
+			self.added_tags.append((photo_id, tags))
+
+		def getInfo(self, photo_id=''):
+			"""The tags of a photo seeded in any album: its self.raw_tags if set, otherwise the
+			tags it was seeded with.
+			"""
+			for pages in self.photosets.photos.values():
+				for page in pages:
+					for p in page['photoset']['photo']:
+						if p['id'] != photo_id:
+							continue
+						raw = self.raw_tags.get(photo_id, p['tags'].split())
+						tags = [{'id': '{}-{}'.format(photo_id, i), 'raw': t}
+								for i, t in enumerate(raw)]
+						return {'photo': {'id': photo_id, 'tags': {'tag': tags}}}
+			raise flickrapi.exceptions.FlickrError("photo doesn't exist", code=1)
+
+		def setTags(self, photo_id='', tags=''):
+			"""Logs the tags set in self.set_tags as a "spy" stub."""
+			self.set_tags.append((photo_id, tags))
+
+		def setMeta(self, photo_id='', title=''):
+			"""Logs the titles set in self.set_meta as a "spy" stub."""
+			self.set_meta.append((photo_id, title))
+
 		def delete(self, photo_id=''):
 			if not photo_id in self.sizes:
 				raise flickrapi.exceptions.FlickrError("photo doesn't exist", code=1)
 
 	def __init__(self):
 		self.photosets = self.StubPhotosets()
-		self.photos = self.StubPhotos()
+		self.photos = self.StubPhotos(self.photosets)
 		self.photo_contents = {}
 		self.uploaded = []
+		self.replaced = []
 
 	def upload(self, filename, **kwargs):
 		"""Create an album, always respond OK with a random album ID. Return a random album ID. Does not actually populate the stub data store, use stubAdd Album for that. Logs the
 		uploaded filenames in self.uploaded as a "spy" stub.
 		"""
 		self.uploaded.append(filename)
-		new_id = random.randint(1000, 10000)
+		# Stream the file like flickrapi does, if it's given as a file object.
+		if kwargs.get('fileobj'):
+			while kwargs['fileobj'].read(8192):
+				pass
+		# Photo IDs are strings, unique per uploaded file.
+		new_id = 'uploaded:' + filename
 
 		rsp = ElementTree.Element('rsp')
 		rsp.attrib['stat'] = 'ok'
+		if kwargs.get('async'):
+			# Asynchronous uploads respond with a ticket for the photo ID instead.
+			ticket_id = 'ticket:' + filename
+			self.photos.upload.tickets[ticket_id] = new_id
+			ticketid = ElementTree.Element('ticketid')
+			ticketid.text = ticket_id
+			rsp.append(ticketid)
+			return rsp
 		photoid = ElementTree.Element('photoid')
 		photoid.text = new_id
 		rsp.append(photoid)
 		return rsp
 
+	def replace(self, filename, photo_id, **kwargs):
+		"""Replace a photo's content, always respond OK. Logs the (filename, photo_id) replaced in
+		self.replaced as a "spy" stub.
+		"""
+		self.replaced.append((filename, photo_id))
+		rsp = ElementTree.Element('rsp')
+		rsp.attrib['stat'] = 'ok'
+		return rsp
+
 	#############################
 	# Helper functions, not stubs
 	#############################
@@ -122,8 +280,10 @@ class StubFlickrAPI():
 		for a in self.photosets.albums:
 			a['photosets']['pages'] = len(self.photosets.albums)
 
-	def stubAddPhoto(self, album_id, title, photo_id, tags, content):
-		"""Seed the stub with a photo. It will appear in stubbed photo-related APIs.
+	def stubAddPhoto(self, album_id, title, photo_id, tags, content, original_url=False):
+		"""Seed the stub with a photo. It will appear in stubbed photo-related APIs. If
+		original_url is set the album listing includes the original's URL, like Flickr does for
+		extras=url_o.
 		"""
 		new_page = {
 			'photoset': {
@@ -137,12 +297,16 @@ class StubFlickrAPI():
 				],
 			},
 		}
+		if original_url:
+			new_page['photoset']['photo'][0]['url_o'] = 'http://domain.com/' + photo_id
 		self.photosets.photos[album_id].append(new_page)
 
 		# Update the number of pages of photos.
 		for p in self.photosets.photos[album_id]:
 			p['photoset']['pages'] = len(self.photosets.photos[album_id])
 
+		self.photos.upload_dates.setdefault(photo_id, 1000 * len(self.photos.upload_dates))
+
 		# Create a URL responses for the photo.
 		self.photos.sizes[photo_id] = {
 			'sizes': {
@@ -162,6 +326,16 @@ class StubFlickrAPI():
 		# Create the URL map.
 		self.photo_contents['http://domain.com/' + photo_id] = content
 
+	def stubUpdatePhoto(self, album_id, photo_id, tags):
+		"""Change a seeded photo's tags. It will be reported as recently updated.
+		"""
+		for page in self.photosets.photos[album_id]:
+			for p in page['photoset']['photo']:
+				if p['id'] == photo_id:
+					p['tags'] = tags
+					updated = dict(p, lastupdate=int(time.time()))
+					self.photos.updated.append(updated)
+
 	def stubURLOpenner(self):
 		"""Returns an object implementing read(url=) to be patched over urllib. Reads for the URL
 		return the photos stored at that URL, added using stubAddPhoto().
@@ -173,11 +347,38 @@ class StubFlickrAPI():
 		"""
 		class Reader():
 			def __init__(self, content):
-				self.content = content
-			def read(self):
-				return self.content
+				self.content = io.BytesIO(content)
+			def read(self, size=-1):
+				return self.content.read(size)
+			def close(self):
+				pass
 
 		def stubURLOpen(url=''):
 			return Reader(self.photo_contents[url])
 
 		return stubURLOpen
+
+	def stubSession(self, open_url=None):
+		"""Returns an object implementing get(url) to be patched over FlickrWrapper.session.
+		Responses stream the reader returned by open_url(url), by default stubURLOpenner().
+
+		Sample usage:
+			flickrwrapper.session = stub_api.stubSession()
+		"""
+		open_url = open_url or self.stubURLOpenner()
+
+		class Response():
+			def __init__(self, reader):
+				self.reader = reader
+			def raise_for_status(self):
+				pass
+			def iter_content(self, chunk_size=1):
+				return iter(lambda: self.reader.read(chunk_size), b'')
+			def close(self):
+				self.reader.close()
+
+		class Session():
+			def get(self, url, stream=False, timeout=None):
+				return Response(open_url(url))
+
+		return Session()
@@ -0,0 +1,85 @@
+import os
+
+import pyfakefs.fake_filesystem_unittest
+
+# Testing support.
+from test.stub_flickrapi import StubFlickrAPI
+from test.stub_flickrapi import small_jpg
+# Unexported names for targetted whitebox testing.
+from flickrsyncr.cache import ChecksumIndex
+from flickrsyncr.cache import LocalCache
+from flickrsyncr.flickrwrapper import FlickrWrapper
+from flickrsyncr.syncer import LocalPhoto
+
+
+class TestLocalCache(pyfakefs.fake_filesystem_unittest.TestCase):
+	"""Tests for the cache.LocalCache class and its use by LocalPhoto.
+	"""
+	def setUp(self):
+		self.setUpPyfakefs()
+		self.fs.create_file('/tmp/filename.jpg', contents=small_jpg)
+		self.flickrwrapper = FlickrWrapper(StubFlickrAPI(), 'userid')
+
+	def testChecksumCached(self):
+		cache = LocalCache('/cfg', '/tmp')
+		photo = LocalPhoto(self.flickrwrapper, 'filename.jpg', '/tmp', cache)
+		self.assertEqual(photo.checksum(), '8c90748342f19b195b9c6b4eff742ded')
+		cache.save()
+
+		# Poison the persisted entry. A reload trusting the cache returns it without reading.
+		cache = LocalCache('/cfg', '/tmp')
+		st = os.stat('/tmp/filename.jpg')
+		cache.put('filename.jpg', st, 'md5', 'cachedchecksum')
+		photo = LocalPhoto(self.flickrwrapper, 'filename.jpg', '/tmp', cache)
+		self.assertEqual(photo.checksum(), 'cachedchecksum')
+
+	def testChecksumInvalidated(self):
+		cache = LocalCache('/cfg', '/tmp')
+		st = os.stat('/tmp/filename.jpg')
+		cache.put('filename.jpg', st, 'md5', 'stalechecksum')
+
+		# Changing the content changes the file's identity, forcing a re-hash.
+		with open('/tmp/filename.jpg', 'ab') as f:
+			f.write(b'more')
+		photo = LocalPhoto(self.flickrwrapper, 'filename.jpg', '/tmp', cache)
+		self.assertNotEqual(photo.checksum(), 'stalechecksum')
+
+	def testPrune(self):
+		cache = LocalCache('/cfg', '/tmp')
+		st = os.stat('/tmp/filename.jpg')
+		cache.put('filename.jpg', st, 'md5', 'checksum1')
+		cache.put('gone.jpg', st, 'md5', 'checksum2')
+		cache.prune(['filename.jpg'])
+		cache.save()
+
+		cache = LocalCache('/cfg', '/tmp')
+		self.assertEqual(cache.get('filename.jpg', st, 'md5'), 'checksum1')
+		self.assertEqual(cache.get('gone.jpg', st, 'md5'), None)
+
+
+class TestChecksumIndex(pyfakefs.fake_filesystem_unittest.TestCase):
+	"""Tests for the cache.ChecksumIndex class.
+	"""
+	def setUp(self):
+		self.setUpPyfakefs()
+		self.stub_api = StubFlickrAPI()
+		self.flickrwrapper = FlickrWrapper(self.stub_api, 'userid')
+		self.stub_api.stubAddAlbum('albumname', 123)
+		self.stub_api.stubAddPhoto(123, 'filename0.jpg', 'photoid0', 'checksum:md5=abc', b'')
+		self.stub_api.stubAddPhoto(123, 'filename1.jpg', 'photoid1', 'checksum:md5=def', b'')
+		self.stub_api.stubAddPhoto(123, 'filename2.jpg', 'photoid2', 'tag', b'')
+
+	def testSearched(self):
+		index = ChecksumIndex('/cfg').load(self.flickrwrapper)
+		self.assertEqual(index, {'abc': 'photoid0', 'def': 'photoid1'})
+
+	def testRefreshedWithUpdates(self):
+		ChecksumIndex('/cfg').load(self.flickrwrapper)
+		self.stub_api.stubUpdatePhoto(123, 'photoid1', 'tag')
+		listing = self.stub_api.photosets.photos[123][2]['photoset']['photo'][0]
+		listing['machine_tags'] = 'checksum:md5=ghi'
+		self.stub_api.stubUpdatePhoto(123, 'photoid2', 'checksummd5ghi')
+
+		index = ChecksumIndex('/cfg').load(self.flickrwrapper)
+		self.assertEqual(index, {'abc': 'photoid0', 'ghi': 'photoid2'})
+		self.assertEqual(self.flickrwrapper.call_counts['photos.search'], 1)
@@ -57,6 +57,27 @@ class TestConfig(unittest.TestCase):
             Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), pull=True, push=True, sync=True),
             # No store to provide api_key and api_secret.
             Config('albumname', '/my/dir', dir_='/my/cfg', push=True),
+            # No checksum workers.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), push=True,
+                    checksum=True, checksum_workers=0),
+            # No HTTP timeout.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), push=True,
+                    http_timeout=0),
+            # Negative bandwidth limit.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), pull=True,
+                    download_limit=-1),
+            # Negative album batch.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), push=True,
+                    album_batch=-1),
+            # Dedupe without checksum.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), push=True,
+                    dedupe=True),
+            # Tree without a directory placeholder in the album name.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), push=True,
+                    tree=True),
+            # Watch without push.
+            Config('albumname', '/my/dir', dir_='/my/cfg', store=StubStore(), pull=True,
+                    watch=True),
         ]
 
         for t in testCases:
@@ -1,4 +1,13 @@
+import hashlib
+import io
+import os
+import tempfile
 import unittest
+from unittest import mock
+import urllib.error
+
+import flickrapi
+import requests
 
 # Testing support.
 from test.stub_flickrapi import StubFlickrAPI
@@ -15,13 +24,63 @@ class TestFlickrWrapper(unittest.TestCase):
 				api_secret='apisecret', tag='tag2')
 		self.stub_api = StubFlickrAPI()
 		self.apiwrapper = flickrwrapper.FlickrWrapper(self.stub_api, 'userid')
-		# Patch urlopen in module flickrwrapper.
-		flickrwrapper.urllib.request.urlopen = self.stub_api.stubURLOpenner()
+		self.apiwrapper.session = self.stub_api.stubSession()
 
 	def testGetAlbumID(self):
 		self.stub_api.stubAddAlbum('albumname', 123)
 		self.assertEqual(self.apiwrapper.getAlbumID('albumname'), 123)
 
+	def testGetAlbumIDLaterPage(self):
+		"""Albums past the first page are found, the first one in account order wins.
+		"""
+		for i in range(10):
+			self.stub_api.stubAddAlbum('album{}'.format(i), i)
+		self.stub_api.stubAddAlbum('album7', 100)
+		self.assertEqual(self.apiwrapper.getAlbumID('album7'), 7)
+		self.assertEqual(self.apiwrapper.getAlbumID('album0'), 0)
+		self.assertEqual(self.apiwrapper.getAlbumID('missing'), None)
+
+	def testListAlbums(self):
+		"""All albums are listed in one pass, the first one of each name wins.
+		"""
+		for i in range(10):
+			self.stub_api.stubAddAlbum('album{}'.format(i), i)
+		self.stub_api.stubAddAlbum('album7', 100)
+		albums = self.apiwrapper.listAlbums()
+		self.assertEqual(albums, {'album{}'.format(i) : i for i in range(10)})
+		self.assertEqual(self.apiwrapper.call_counts['photosets.getList'], 11)
+
+	def testListAlbumPageOrder(self):
+		"""Pages fetched concurrently are returned in album order.
+		"""
+		self.stub_api.stubAddAlbum('albumname', 123)
+		ids = [str(i) for i in range(30)]
+		for photo_id in ids:
+			self.stub_api.stubAddPhoto(123, 'Photo ' + photo_id, photo_id, '', b'')
+		self.assertEqual([p['id'] for p in self.apiwrapper.listAlbum(123)], ids)
+
+	def testCallCounts(self):
+		self.stub_api.stubAddAlbum('albumname', 123)
+		self.stub_api.stubAddPhoto(123, 'Photo 1', '1111', '', b'')
+		self.apiwrapper.getAlbumID('albumname')
+		self.apiwrapper.listAlbum(123)
+		self.apiwrapper.listAlbum(123)
+		self.assertEqual(self.apiwrapper.call_counts,
+				{'photosets.getList': 1, 'photosets.getPhotos': 2})
+
+	def testCallsRateLimited(self):
+		class SpyLimiter():
+			acquired = 0
+			def acquire(self, amount=1):
+				self.acquired += amount
+
+		limiter = SpyLimiter()
+		apiwrapper = flickrwrapper.FlickrWrapper(self.stub_api, 'userid', limiter)
+		self.stub_api.stubAddAlbum('albumname', 123)
+		apiwrapper.getAlbumID('albumname')
+		apiwrapper.createAlbum('albumname', 'photoid')
+		self.assertEqual(limiter.acquired, 2)
+
 	def testCreateAlbum(self):
 		self.assertNotEqual(self.apiwrapper.createAlbum('albumname', 'userid'), 0)
 
@@ -72,10 +131,148 @@ class TestFlickrWrapper(unittest.TestCase):
 		self.apiwrapper.upload('/tmp/filename1', 'Photo Title 1', 'tag1 tag2', album_name='albumname')
 		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename1'])
 
+	def testUploadRecreatesMissingAlbumOnce(self):
+		"""Uploads that all find the album missing share one re-created album.
+		"""
+		album_ids = [self.apiwrapper.upload('/tmp/filename{}'.format(i), 'Photo Title', '',
+				album_name='albumname', album_id=123) for i in range(3)]
+		self.assertEqual(self.stub_api.photosets.created, ['albumname'])
+		self.assertEqual(len(set(album_ids)), 1)
+
+	@mock.patch('flickrsyncr.flickrwrapper.SEARCH_RESULT_LIMIT', 2)
+	def testListChecksummedPastSearchLimit(self):
+		"""Searches that Flickr would cut off are split by upload date until they fit.
+		"""
+		self.stub_api.photos.search_limit = 2
+		self.stub_api.stubAddAlbum('albumname', 123)
+		ids = ['photoid{}'.format(i) for i in range(5)]
+		for i in ids:
+			self.stub_api.stubAddPhoto(123, i, i, 'checksum:md5=' + i, b'')
+		self.stub_api.stubAddPhoto(123, 'untagged', 'untagged', 'tag', b'')
+
+		with self.assertNoLogs('flickrsyncr.flickrwrapper', level='WARNING'):
+			photos = self.apiwrapper.listChecksummed()
+		self.assertEqual(sorted(p['id'] for p in photos), ids)
+
+	@mock.patch('flickrsyncr.flickrwrapper.TICKET_CHECK_BATCH', 2)
+	def testUploadAsyncCheckTickets(self):
+		"""Asynchronous uploads return tickets, which are checked in batches.
+		"""
+		tickets = [self.apiwrapper.uploadPhotoAsync('/tmp/filename{}'.format(i), 'Photo Title',
+				'') for i in range(3)]
+		self.assertEqual(self.apiwrapper.checkTickets(tickets), {})
+		self.assertEqual(self.apiwrapper.checkTickets(tickets),
+				{t : 'uploaded:/tmp/filename{}'.format(i) for i, t in enumerate(tickets)})
+		self.assertEqual(self.apiwrapper.call_counts['photos.upload.checkTickets'], 4)
+
+	def testBandwidthLimits(self):
+		"""Uploads and downloads pass their bytes through the bandwidth limiters.
+		"""
+		class SpyBucket():
+			def __init__(self):
+				self.acquired = 0
+			def acquire(self, amount=1):
+				self.acquired += amount
+
+		self.apiwrapper.upload_limiter = SpyBucket()
+		self.apiwrapper.download_limiter = SpyBucket()
+		self.stub_api.stubAddAlbum('albumname', 123)
+		self.stub_api.stubAddPhoto(123, 'Photo 1', 'photoid123', 'tag1', b'filecontent')
+
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			output_path = os.path.join(tmp_dir, 'Photo 1')
+			self.apiwrapper.download('photoid123', output_path)
+			self.apiwrapper.uploadPhoto(output_path, 'Photo 1', '')
+		self.assertEqual(self.apiwrapper.download_limiter.acquired, len(b'filecontent'))
+		self.assertEqual(self.apiwrapper.upload_limiter.acquired, len(b'filecontent'))
+
+	def testUploadDigest(self):
+		"""An upload hashes the file as it's read, also through the upload limiter.
+		"""
+		class SpyBucket():
+			def acquire(self, amount=1):
+				pass
+
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			filename = os.path.join(tmp_dir, 'Photo 1')
+			with open(filename, 'wb') as f:
+				f.write(b'filecontent')
+			digest = hashlib.md5()
+			self.apiwrapper.uploadPhoto(filename, 'Photo 1', '', digest)
+			self.assertEqual(digest.hexdigest(), hashlib.md5(b'filecontent').hexdigest())
+
+			self.apiwrapper.upload_limiter = SpyBucket()
+			digest = hashlib.md5()
+			self.apiwrapper.uploadPhotoAsync(filename, 'Photo 1', '', digest)
+			self.assertEqual(digest.hexdigest(), hashlib.md5(b'filecontent').hexdigest())
+
 	def testDownload(self):
 		"""Seed the stub with file content and download it.
 		"""
 		self.stub_api.stubAddAlbum('albumname', 123)
 		self.stub_api.stubAddPhoto(123, 'Photo 1', 'photoid123', 'tag1 tag2 tag3', b'filecontent')
 
-		self.assertEqual(self.apiwrapper.download(photo_id='photoid123'), b'filecontent')
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			output_path = os.path.join(tmp_dir, 'Photo 1')
+			self.apiwrapper.download('photoid123', output_path)
+			with open(output_path, 'rb') as f:
+				self.assertEqual(f.read(), b'filecontent')
+			# Only the final file is left behind.
+			self.assertEqual(os.listdir(tmp_dir), ['Photo 1'])
+
+	def testDownloadFailureKeepsExistingFile(self):
+		"""A download failing mid-stream leaves the existing file untouched and no partial file
+		behind.
+		"""
+		class BrokenReader(io.BytesIO):
+			def read(self, size=-1):
+				if self.tell():
+					raise ConnectionResetError('connection dropped')
+				return super().read(4)
+
+		self.stub_api.stubAddAlbum('albumname', 123)
+		self.stub_api.stubAddPhoto(123, 'Photo 1', 'photoid123', 'tag1', b'filecontent')
+		self.apiwrapper.session = self.stub_api.stubSession(
+				lambda url: BrokenReader(b'newcontent'))
+		with tempfile.TemporaryDirectory() as tmp_dir:
+			output_path = os.path.join(tmp_dir, 'Photo 1')
+			with open(output_path, 'wb') as f:
+				f.write(b'oldcontent')
+			with self.assertRaises(ConnectionResetError):
+				self.apiwrapper.download('photoid123', output_path)
+			with open(output_path, 'rb') as f:
+				self.assertEqual(f.read(), b'oldcontent')
+			self.assertEqual(os.listdir(tmp_dir), ['Photo 1'])
+
+	def httpResponse(self, status_code):
+		response = requests.Response()
+		response.status_code = status_code
+		return response
+
+	def testNewSessionPoolSize(self):
+		"""Downloads keep a connection alive per worker.
+		"""
+		session = flickrwrapper.newSession(16)
+		self.assertEqual(session.get_adapter('https://live.staticflickr.com/')._pool_maxsize, 16)
+
+	def testIsTransientError(self):
+		transient = [
+			urllib.error.URLError('connection refused'),
+			urllib.error.HTTPError('http://domain.com/', 503, 'unavailable', {}, None),
+			flickrapi.exceptions.FlickrError('do_request: Status code 502 received'),
+			flickrapi.exceptions.FlickrError('Service currently unavailable', code=105),
+			TimeoutError(),
+			requests.exceptions.ConnectionError('connection reset'),
+			requests.exceptions.HTTPError(response=self.httpResponse(503)),
+		]
+		permanent = [
+			urllib.error.HTTPError('http://domain.com/', 404, 'not found', {}, None),
+			flickrapi.exceptions.FlickrError('do_request: Status code 403 received'),
+			flickrapi.exceptions.FlickrError('Photo not found', code=1),
+			ValueError(),
+			requests.exceptions.HTTPError(response=self.httpResponse(404)),
+		]
+		for err in transient:
+			self.assertTrue(flickrwrapper.isTransientError(err), err)
+		for err in permanent:
+			self.assertFalse(flickrwrapper.isTransientError(err), err)
@@ -1,19 +1,27 @@
 import unittest
+from unittest import mock
 import os
 
+import flickrapi
 import pyfakefs.fake_filesystem_unittest
+import requests
 
 # Testing support.
 from test.stub_flickrapi import StubFlickrAPI
 from test.stub_flickrapi import small_jpg
-import flickrsyncr.flickrwrapper  # Import only so it can be patched with stubs.
 # Officially exported names.
 from flickrsyncr import Config
 from flickrsyncr import sync
+from flickrsyncr import SyncError
 # Unexported names for targetted whitebox testing.
+from flickrsyncr.cache import LocalCache
 from flickrsyncr.flickrwrapper import FlickrWrapper
+from flickrsyncr.journal import Journal
+from flickrsyncr.syncer import AlbumBatch
 from flickrsyncr.syncer import LocalPhoto
 from flickrsyncr.syncer import RemotePhoto
+from flickrsyncr.syncer import diffPhotos
+from flickrsyncr.syncer import listedTags
 from flickrsyncr.syncer import loadRemotePhotos
 from flickrsyncr.syncer import loadLocalPhotos
 
@@ -39,6 +47,19 @@ class TestLocalPhoto(pyfakefs.fake_filesystem_unittest.TestCase):
 	def testChecksum(self):
 		self.assertEqual(self.photo.checksum(), '8c90748342f19b195b9c6b4eff742ded')
 
+	def testMimeType(self):
+		"""Image extensions aren't sniffed, other files are sniffed once while unchanged."""
+		self.fs.create_file('/tmp/filename.dat', contents=small_jpg)
+		cache = LocalCache('/cfg', '/tmp')
+		photo = LocalPhoto(self.photo.flickrwrapper, 'filename.dat', '/tmp', cache)
+		with mock.patch('flickrsyncr.syncer.magic.from_buffer',
+				return_value='image/jpeg') as from_buffer:
+			self.assertEqual(self.photo.mimeType(), 'image/jpeg')
+			self.assertEqual(from_buffer.call_count, 0)
+			self.assertEqual(photo.mimeType(), 'image/jpeg')
+			self.assertEqual(photo.mimeType(), 'image/jpeg')
+			self.assertEqual(from_buffer.call_count, 1)
+
 	def testUploadWithNoAlbum(self):
 		# Upload to a non-existent album, denoted by empty album_id.
 		config = Config('albumname', '/tmp', checksum=True)
@@ -67,7 +88,7 @@ class TestRemotePhoto(pyfakefs.fake_filesystem_unittest.TestCase):
 		self.stub_api.stubAddPhoto(123, self.photo.title, self.photo.photo_id,
 				' '.join(self.photo.tags), small_jpg)
 
-		flickrsyncr.flickrwrapper.urllib.request.urlopen = self.stub_api.stubURLOpenner()
+		flickrwrapper.session = self.stub_api.stubSession()
 
 	def testDelete(self):
 		config = Config('albumname', '/tmp', checksum=True)
@@ -76,6 +97,15 @@ class TestRemotePhoto(pyfakefs.fake_filesystem_unittest.TestCase):
 	def testGetChecksum(self):
 		self.assertEqual(self.photo.checksum(), '8c90748342f19b195b9c6b4eff742ded')
 
+	def testGetChecksumNormalized(self):
+		"""Flickr lists tags normalized, and machine tags as set."""
+		normalized = RemotePhoto(None, 'filename.jpg', 'photoid123',
+				['tag1', 'checksummd58c90748342f19b195b9c6b4eff742ded'])
+		self.assertEqual(normalized.checksum(), '8c90748342f19b195b9c6b4eff742ded')
+		machine = RemotePhoto(None, 'filename.jpg', 'photoid123',
+				listedTags({'tags': 'tag1', 'machine_tags': 'checksum:md5=abc'}))
+		self.assertEqual(machine.checksum(), 'abc')
+
 	def testTransfer(self):
 		config = Config('albumname', '/tmp', checksum=True)
 		config.album_id = 123
@@ -105,7 +135,33 @@ class TestGetPhotos(pyfakefs.fake_filesystem_unittest.TestCase):
 		got = loadLocalPhotos(config, flickrwrapper)
 		self.assertEqual(sorted(want), sorted(got))
 
+	def testLoadLocalPhotosFiltered(self):
+		self.setUpPyfakefs()
+		self.fs.create_file('/tmp/IMG_1.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/IMG_2.JPG', contents=small_jpg)
+		self.fs.create_file('/tmp/IMG_3.png', contents=small_jpg)
+		self.fs.create_file('/tmp/IMG_4.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/other.jpg', contents=small_jpg)
+		self.fs.create_dir('/tmp/IMG_5.jpg')
+
+		flickrwrapper = FlickrWrapper(StubFlickrAPI(), 'userid')
+		config = Config('albumname', '/tmp', include=['IMG_*'], exclude=['*_4.*'],
+				extensions=['jpg'])
+
+		got = sorted(loadLocalPhotos(config, flickrwrapper))
+		self.assertEqual(['IMG_1.jpg', 'IMG_2.JPG'], [p.title for p in got])
+		# The listing's stat is kept for checksumming.
+		self.assertEqual(os.stat('/tmp/IMG_1.jpg').st_size, got[0].st.st_size)
+
+	def testLoadLocalPhotosMissingPath(self):
+		self.setUpPyfakefs()
+		flickrwrapper = FlickrWrapper(StubFlickrAPI(), 'userid')
+		config = Config('albumname', '/missing')
+		with self.assertRaises(SyncError):
+			list(loadLocalPhotos(config, flickrwrapper))
+
 	def testLoadRemotePhotos(self):
+		self.setUpPyfakefs()  # The album listing is cached in the config dir.
 		self.stub_api = StubFlickrAPI()
 		flickrwrapper = FlickrWrapper(self.stub_api, 'userid')
 		config = Config('albumname', '/tmp', checksum=True)
@@ -127,6 +183,84 @@ class TestGetPhotos(pyfakefs.fake_filesystem_unittest.TestCase):
 		sort_key = lambda p: p.title
 		self.assertEqual(sorted(want, key=sort_key), sorted(got, key=sort_key))
 
+		# Photos the local file filters leave out aren't listed either.
+		config.exclude = ['* 2', '* 4']
+		got = loadRemotePhotos(config, flickrwrapper)
+		self.assertEqual(['Photo 1', 'Photo 3'], sorted(p.title for p in got))
+
+	def testLoadRemotePhotosDelta(self):
+		"""The cached listing is reused while membership is unchanged, with updates applied."""
+		self.setUpPyfakefs()
+		self.stub_api = StubFlickrAPI()
+		flickrwrapper = FlickrWrapper(self.stub_api, 'userid')
+		config = Config('albumname', '/tmp', checksum=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(123, 'Photo 1', '1111', 'tag1', b'')
+		self.stub_api.stubAddPhoto(123, 'Photo 2', '2222', 'tag1', b'')
+		loadRemotePhotos(config, flickrwrapper)
+
+		# An unchanged album isn't listed again, but photo updates are picked up.
+		self.stub_api.photosets.listed.clear()
+		self.stub_api.stubUpdatePhoto(123, '2222', 'tag1 tag2')
+		got = {p.photo_id : p.tags for p in loadRemotePhotos(config, flickrwrapper)}
+		self.assertEqual(got, {'1111': ['tag1'], '2222': ['tag1', 'tag2']})
+		self.assertEqual(self.stub_api.photosets.listed, [])
+
+		# A forced refresh lists the album in full.
+		config.refresh = True
+		loadRemotePhotos(config, flickrwrapper)
+		self.assertNotEqual(self.stub_api.photosets.listed, [])
+
+	def testLoadRemotePhotosMembershipChanged(self):
+		"""Adding a photo to the album invalidates the cached listing."""
+		self.setUpPyfakefs()
+		self.stub_api = StubFlickrAPI()
+		flickrwrapper = FlickrWrapper(self.stub_api, 'userid')
+		config = Config('albumname', '/tmp', checksum=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(123, 'Photo 1', '1111', 'tag1', b'')
+		loadRemotePhotos(config, flickrwrapper)
+		self.stub_api.stubAddPhoto(123, 'Photo 2', '2222', 'tag1', b'')
+		got = sorted(p.photo_id for p in loadRemotePhotos(config, flickrwrapper))
+		self.assertEqual(got, ['1111', '2222'])
+
+		# So does a change in the album's video count.
+		self.stub_api.photosets.listed.clear()
+		self.stub_api.photosets.videos[123] = 1
+		loadRemotePhotos(config, flickrwrapper)
+		self.assertNotEqual(self.stub_api.photosets.listed, [])
+
+
+class TestDiffPhotos(pyfakefs.fake_filesystem_unittest.TestCase):
+	"""Tests for the diffPhotos function. (It's not exported, but convenient to test.)
+	"""
+	def testParallelChecksums(self):
+		self.setUpPyfakefs()
+		flickrwrapper = FlickrWrapper(StubFlickrAPI(), 'userid')
+		local_photos = []
+		remote_photos = []
+		for i in range(8):
+			title = 'filename{}.jpg'.format(i)
+			self.fs.create_file('/tmp/' + title, contents=small_jpg+bytes([i]))
+			local_photos.append(LocalPhoto(flickrwrapper, title, '/tmp'))
+			# Every other remote photo has the right checksum.
+			checksum = local_photos[-1].checksum() if i % 2 else 'badchecksum'
+			remote_photos.append(RemotePhoto(flickrwrapper, title, str(i),
+					['checksum:md5=' + checksum]))
+		self.fs.create_file('/tmp/localonly.jpg', contents=small_jpg)
+		local_photos.append(LocalPhoto(flickrwrapper, 'localonly.jpg', '/tmp'))
+
+		local_only, remote_only, mismatched = diffPhotos(local_photos, remote_photos, workers=4)
+		self.assertEqual(local_only, [local_photos[-1]])
+		self.assertEqual(remote_only, [])
+		self.assertEqual(sorted(m.local_photo.title for m in mismatched),
+				['filename0.jpg', 'filename2.jpg', 'filename4.jpg', 'filename6.jpg'])
+
+
 class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 	"""Test the sync() function. (Finally, something that's actually intended for export.)
 	"""
@@ -134,7 +268,7 @@ class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 		self.setUpPyfakefs()
 		self.stub_api = StubFlickrAPI()
 		self.flickrwrapper = FlickrWrapper(self.stub_api, 'userid')
-		flickrsyncr.flickrwrapper.urllib.request.urlopen = self.stub_api.stubURLOpenner()
+		self.flickrwrapper.session = self.stub_api.stubSession()
 
 	def testPullCleanMerge(self):
 		"""Pull, merge distinct local and remote content."""
@@ -162,6 +296,26 @@ class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 		with open('/tmp/filename2.jpg', 'rb') as f:
 			self.assertEqual(f.read(), small_jpg+b'2')
 
+	def testPullUsesListedURLs(self):
+		"""Pull, photos listed with their original's URL are downloaded without a lookup."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret', pull=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename1.jpg', 'filename1.jpg', 'tag',
+				small_jpg+b'1', original_url=True)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename2.jpg', 'filename2.jpg', 'tag',
+				small_jpg+b'2')
+
+		sync(config, self.flickrwrapper)
+
+		with open('/tmp/filename1.jpg', 'rb') as f:
+			self.assertEqual(f.read(), small_jpg+b'1')
+		with open('/tmp/filename2.jpg', 'rb') as f:
+			self.assertEqual(f.read(), small_jpg+b'2')
+		# Only the photo listed without a URL needed getSizes().
+		self.assertEqual(self.stub_api.photos.sizes_requested, ['filename2.jpg'])
+
 	def testPullFavorLocal(self):
 		"""Pull, don't overwrite mismatched local content."""
 		self.fs.create_file('/tmp/filename0.jpg', contents=b'bad content')
@@ -215,6 +369,172 @@ class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 		with open('/tmp/filename2.jpg', 'rb') as f:
 			self.assertEqual(f.read(), small_jpg+b'2')
 
+	def testPullRenamed(self):
+		"""Pull sync, a photo renamed on Flickr is renamed locally instead of downloaded."""
+		self.fs.create_file('/tmp/oldname.jpg', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, pull=True, sync=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'newname.jpg', 'photoid0',
+				'checksum:md5=8c90748342f19b195b9c6b4eff742ded', small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(os.listdir('/tmp'), ['newname.jpg'])
+		self.assertEqual(self.stub_api.photos.sizes_requested, [])
+
+	def testPullAdaptiveWorkers(self):
+		"""Pull with adaptive workers, downloads run within the adaptive limit."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				pull=True, download_workers=4, adaptive_workers=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		titles = ['filename{}.jpg'.format(i) for i in range(6)]
+		for t in titles:
+			self.stub_api.stubAddPhoto(config.album_id, t, t, 'tag', small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		for t in titles:
+			self.assertTrue(os.path.exists('/tmp/' + t))
+		limit = self.flickrwrapper.transfer_limits['download']
+		self.assertEqual(limit.maximum, 4)
+		self.assertEqual(limit.active, 0)
+		self.assertNotIn('upload', self.flickrwrapper.transfer_limits)
+
+	def testPullParallelCollectsErrors(self):
+		"""Pull in parallel, a failed download doesn't stop the others."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				pull=True, download_workers=4)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		for i in range(6):
+			title = 'filename{}.jpg'.format(i)
+			self.stub_api.stubAddPhoto(config.album_id, title, title, 'tag', small_jpg+bytes([i]))
+		# Flickr offers no original for one of the photos.
+		self.stub_api.photos.sizes['filename3.jpg']['sizes']['size'].pop(0)
+
+		with self.assertRaisesRegex(SyncError, 'filename3.jpg'):
+			sync(config, self.flickrwrapper)
+
+		for i in range(6):
+			self.assertEqual(os.path.exists('/tmp/filename{}.jpg'.format(i)), i != 3)
+
+	@mock.patch('flickrsyncr.syncer.time.sleep')
+	def testPullRetriesTransientErrors(self, sleep):
+		"""Pull, downloads failing with network errors are retried."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				pull=True, retries=2)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'flaky.jpg', 'flaky.jpg', 'tag', small_jpg)
+		self.stub_api.stubAddPhoto(config.album_id, 'down.jpg', 'down.jpg', 'tag', small_jpg)
+
+		# "flaky.jpg" fails twice then succeeds, "down.jpg" always fails.
+		failures = {'http://domain.com/flaky.jpg': 2, 'http://domain.com/down.jpg': 100}
+		stub_urlopen = self.stub_api.stubURLOpenner()
+		def urlopen(url):
+			if failures[url]:
+				failures[url] -= 1
+				raise requests.exceptions.ConnectionError('connection refused')
+			return stub_urlopen(url)
+		self.flickrwrapper.session = self.stub_api.stubSession(urlopen)
+
+		with self.assertRaisesRegex(SyncError, 'down.jpg: failed 3 times'):
+			sync(config, self.flickrwrapper)
+
+		with open('/tmp/flaky.jpg', 'rb') as f:
+			self.assertEqual(f.read(), small_jpg)
+		self.assertFalse(os.path.exists('/tmp/down.jpg'))
+		self.assertEqual(sleep.call_count, 4)
+
+	@mock.patch('flickrsyncr.syncer.time.sleep')
+	def testPullPermanentErrorFailsOnePhoto(self, sleep):
+		"""Pull, a download failing with a permanent HTTP error isn't retried, and doesn't stop
+		the others."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				pull=True, retries=2)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		titles = ['filename{}.jpg'.format(i) for i in range(4)]
+		for t in titles:
+			self.stub_api.stubAddPhoto(config.album_id, t, t, 'tag', small_jpg)
+
+		stub_urlopen = self.stub_api.stubURLOpenner()
+		def urlopen(url):
+			if url == 'http://domain.com/filename1.jpg':
+				response = requests.models.Response()
+				response.status_code = 404
+				raise requests.exceptions.HTTPError('404 Not Found', response=response)
+			return stub_urlopen(url)
+		self.flickrwrapper.session = self.stub_api.stubSession(urlopen)
+
+		with self.assertRaisesRegex(SyncError, 'filename1.jpg: 404 Not Found'):
+			sync(config, self.flickrwrapper)
+
+		for t in titles:
+			self.assertEqual(os.path.exists('/tmp/' + t), t != 'filename1.jpg')
+		self.assertEqual(sleep.call_count, 0)
+
+	def testPullResume(self):
+		"""Pull is interrupted, resuming only downloads what's left without listing again."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret', pull=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		titles = ['filename{}.jpg'.format(i) for i in range(4)]
+		for t in titles:
+			self.stub_api.stubAddPhoto(config.album_id, t, t, 'tag', small_jpg)
+
+		# Crash on the third download.
+		opened = []
+		stub_urlopen = self.stub_api.stubURLOpenner()
+		def urlopen(url):
+			opened.append(url)
+			if len(opened) == 3:
+				raise RuntimeError('crash')
+			return stub_urlopen(url)
+		self.flickrwrapper.session = self.stub_api.stubSession(urlopen)
+
+		with self.assertRaises(RuntimeError):
+			sync(config, self.flickrwrapper)
+		self.assertFalse(os.path.exists('/tmp/filename2.jpg'))
+
+		opened.clear()
+		self.stub_api.photosets.listed.clear()
+		config.resume = True
+		sync(config, self.flickrwrapper)
+
+		for t in titles:
+			self.assertTrue(os.path.exists('/tmp/' + t))
+		# Completed downloads aren't repeated. (The one queued after the crash may or may not
+		# have run.)
+		self.assertEqual(opened[0], 'http://domain.com/filename2.jpg')
+		self.assertNotIn('http://domain.com/filename0.jpg', opened)
+		self.assertNotIn('http://domain.com/filename1.jpg', opened)
+		self.assertEqual(self.stub_api.photosets.listed, [])
+		# The journal is gone once the sync completes.
+		self.assertEqual([f for f in os.listdir(config.dir_) if f.startswith('journal-')], [])
+
+	def testResumeDifferentSettings(self):
+		"""Resuming with settings that don't match the interrupted sync is an error."""
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret', pull=True)
+		config.album_id = 123
+		Journal(config.dir_, config.album, config.path).start(config, [])
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				pull=True, sync=True, resume=True)
+		config.album_id = 123
+		with self.assertRaisesRegex(SyncError, 'Cannot resume'):
+			sync(config, self.flickrwrapper)
+
 	def testPushCleanMerge(self):
 		"""Push, merge distinct local and remote content."""
 		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg+b'0')
@@ -232,6 +552,215 @@ class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 		self.assertEqual(sorted(self.stub_api.uploaded), sorted(['/tmp/filename0.jpg',
 				'/tmp/filename1.jpg']))
 
+	def testPushParallelCreatesAlbumOnce(self):
+		"""Push in parallel to a missing album, it's only created once."""
+		titles = ['filename{}.jpg'.format(i) for i in range(8)]
+		for t in titles:
+			self.fs.create_file('/tmp/' + t, contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, upload_workers=4)
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(sorted(self.stub_api.uploaded), ['/tmp/' + t for t in titles])
+		self.assertEqual(self.stub_api.photosets.created, ['albumname'])
+		self.assertEqual(config.album_id, self.stub_api.photosets.created_ids[0])
+
+	def testPushRenamed(self):
+		"""Push sync, a photo renamed locally is renamed on Flickr instead of uploaded."""
+		self.fs.create_file('/tmp/newname.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/filename1.jpg', contents=small_jpg+b'1')
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, sync=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'oldname.jpg', 'photoid0',
+				'checksum:md5=8c90748342f19b195b9c6b4eff742ded', small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.photos.set_meta, [('photoid0', 'newname.jpg')])
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename1.jpg'])
+
+	def testPushAlbumBatch(self):
+		"""Push, uploaded photos are added to the album in batches."""
+		titles = ['filename{}.jpg'.format(i) for i in range(5)]
+		for t in titles:
+			self.fs.create_file('/tmp/' + t, contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, upload_workers=2, album_batch=2)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'existing.jpg', 'photoid0', 'tag',
+				small_jpg)
+
+		with mock.patch.object(AlbumBatch, '_submit', autospec=True,
+				side_effect=AlbumBatch._submit) as submit:
+			sync(config, self.flickrwrapper)
+
+		self.assertEqual([len(c[0][1]) for c in submit.call_args_list if c[0][1]], [2, 2, 1])
+		self.assertEqual(sorted(photo_id for _, photo_id in self.stub_api.photosets.added),
+				sorted('uploaded:/tmp/' + t for t in titles))
+
+	@mock.patch('flickrsyncr.syncer.time.sleep')
+	def testPushAsyncUploads(self, sleep):
+		"""Push, asynchronous uploads are added to the album once their tickets resolve."""
+		titles = ['filename{}.jpg'.format(i) for i in range(3)]
+		for t in titles:
+			self.fs.create_file('/tmp/' + t, contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, upload_workers=2, async_uploads=True, album_batch=10)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'existing.jpg', 'photoid0', 'tag',
+				small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		# All tickets are checked in one call, once while processing and once done.
+		self.assertEqual(len(self.stub_api.photos.upload.checked), 2)
+		self.assertEqual(sorted(self.stub_api.photos.upload.checked[0].split(',')),
+				sorted('ticket:/tmp/' + t for t in titles))
+		self.assertEqual(sleep.call_count, 1)
+		self.assertEqual(sorted(photo_id for _, photo_id in self.stub_api.photosets.added),
+				sorted('uploaded:/tmp/' + t for t in titles))
+
+	def testPushResumeAlbumBatch(self):
+		"""Push is interrupted before uploads are added to the album, resuming only adds them."""
+		titles = ['filename{}.jpg'.format(i) for i in range(3)]
+		for t in titles:
+			self.fs.create_file('/tmp/' + t, contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, album_batch=10)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'existing.jpg', 'photoid0', 'tag',
+				small_jpg)
+
+		with mock.patch.object(self.flickrwrapper, 'addToAlbum',
+				side_effect=RuntimeError('crash')):
+			with self.assertRaises(RuntimeError):
+				sync(config, self.flickrwrapper)
+		self.assertEqual(len(self.stub_api.uploaded), 3)
+
+		config.resume = True
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(len(self.stub_api.uploaded), 3)
+		self.assertEqual(sorted(photo_id for _, photo_id in self.stub_api.photosets.added),
+				sorted('uploaded:/tmp/' + t for t in titles))
+
+	@mock.patch('flickrsyncr.syncer.time.sleep')
+	def testPushResumeAsyncUploads(self, sleep):
+		"""Push is interrupted while Flickr processes asynchronous uploads, resuming checks
+		their tickets instead of uploading them again."""
+		titles = ['filename{}.jpg'.format(i) for i in range(3)]
+		for t in titles:
+			self.fs.create_file('/tmp/' + t, contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, async_uploads=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'existing.jpg', 'photoid0', 'tag',
+				small_jpg)
+
+		with mock.patch.object(self.flickrwrapper, 'checkTickets',
+				side_effect=RuntimeError('crash')):
+			with self.assertRaises(RuntimeError):
+				sync(config, self.flickrwrapper)
+		self.assertEqual(len(self.stub_api.uploaded), 3)
+
+		config.resume = True
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(len(self.stub_api.uploaded), 3)
+		self.assertEqual(sorted(self.stub_api.photos.upload.checked[0].split(',')),
+				sorted('ticket:/tmp/' + t for t in titles))
+		self.assertEqual(sorted(photo_id for _, photo_id in self.stub_api.photosets.added),
+				sorted('uploaded:/tmp/' + t for t in titles))
+
+	def testPushDedupe(self):
+		"""Push, files already in another album are added to the album instead of uploaded."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/filename1.jpg', contents=small_jpg+b'1')
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, dedupe=True, tag='mytag')
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename2.jpg', 'photoid2', 'mytag',
+				small_jpg+b'2')
+		self.stub_api.stubAddAlbum('otheralbum', 456)
+		self.stub_api.stubAddPhoto(456, 'other.jpg', 'photoid9',
+				'checksum:md5=8c90748342f19b195b9c6b4eff742ded', small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename1.jpg'])
+		self.assertIn((123, 'photoid9'), self.stub_api.photosets.added)
+		self.assertEqual(self.stub_api.photos.added_tags, [('photoid9', 'mytag')])
+
+	def testPushDedupeTwice(self):
+		"""Push, a file added to the album as an existing photo is present on the next push. The
+		photo isn't uploaded again, or renamed even with sync."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, sync=True, dedupe=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename2.jpg', 'photoid2', '',
+				small_jpg+b'2')
+		self.stub_api.stubAddAlbum('otheralbum', 456)
+		checksum_tag = 'checksum:md5=8c90748342f19b195b9c6b4eff742ded'
+		self.stub_api.stubAddPhoto(456, 'other.jpg', 'photoid9', checksum_tag, small_jpg)
+
+		sync(config, self.flickrwrapper)
+		self.assertIn((123, 'photoid9'), self.stub_api.photosets.added)
+		# Flickr lists the added photo in the album from then on.
+		self.stub_api.stubAddPhoto(config.album_id, 'other.jpg', 'photoid9', checksum_tag,
+				small_jpg)
+		self.stub_api.photosets.added = []
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, [])
+		self.assertEqual(self.stub_api.photosets.added, [])
+		self.assertEqual(self.stub_api.photos.set_meta, [])
+
+	def testPushDedupeDeletedPhoto(self):
+		"""Push, a file whose indexed duplicate was deleted is uploaded after all."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, dedupe=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename2.jpg', 'photoid2', 'mytag',
+				small_jpg+b'2')
+		self.stub_api.stubAddAlbum('otheralbum', 456)
+		self.stub_api.stubAddPhoto(456, 'other.jpg', 'photoid9',
+				'checksum:md5=8c90748342f19b195b9c6b4eff742ded', small_jpg)
+		self.stub_api.photosets.missing_photos.add('photoid9')
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename0.jpg'])
+
 	def test_push_favor_remote(self):
 		"""Push, don't overwrite remote mismatched content."""
 		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg+b'0')
@@ -248,6 +777,79 @@ class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 
 		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename0.jpg'])
 
+	def testPushBackfillFailure(self):
+		"""Push, a photo that can't be tagged with its checksum doesn't stop the uploads."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/filename1.jpg', contents=small_jpg+b'1')
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, backfill_checksums=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename0.jpg', 'photoid0', 'tag',
+				small_jpg)
+
+		add_tags = self.stub_api.photos.addTags
+		def addTags(photo_id='', tags=''):
+			if photo_id == 'photoid0':
+				raise flickrapi.exceptions.FlickrError("photo doesn't exist", code=1)
+			add_tags(photo_id, tags)
+
+		with mock.patch.object(self.stub_api.photos, 'addTags', addTags):
+			with self.assertRaisesRegex(SyncError, 'filename0.jpg'):
+				sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename1.jpg'])
+
+	def testPushBackfillChecksums(self):
+		"""Push, remote photos without checksums are tagged instead of uploaded again."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/filename1.jpg', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, backfill_checksums=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename0.jpg', 'filename0.jpg', 'tag',
+				small_jpg)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename1.jpg', 'filename1.jpg',
+				'checksummd5badchecksum', small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		# The untagged photo is tagged, the one with the wrong checksum is still replaced.
+		self.assertEqual(self.stub_api.photos.added_tags,
+				[('filename0.jpg', 'checksum:md5=8c90748342f19b195b9c6b4eff742ded')])
+		self.assertEqual(self.stub_api.uploaded, [])
+		self.assertEqual(self.stub_api.replaced, [('/tmp/filename1.jpg', 'filename1.jpg')])
+
+	def testPushReplaceMismatched(self):
+		"""Push, mismatched remote photos are replaced in place with their tags kept."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, tag='mytag')
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'filename0.jpg', 'photoid0',
+				'mytag newyork checksummd5badchecksum', b'bad content')
+		listing = self.stub_api.photosets.photos[123][0]['photoset']['photo'][0]
+		listing['machine_tags'] = 'checksum:md5=badchecksum'
+		self.stub_api.photos.raw_tags['photoid0'] = ['mytag', 'New York',
+				'checksum:md5=badchecksum']
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, [])
+		self.assertEqual(self.stub_api.photosets.created, [])
+		self.assertEqual(self.stub_api.replaced, [('/tmp/filename0.jpg', 'photoid0')])
+		# The tags are set as they were set, only the checksum tag is swapped.
+		self.assertEqual(self.stub_api.photos.set_tags, [('photoid0',
+				'"New York" mytag checksum:md5=8c90748342f19b195b9c6b4eff742ded')])
+
 	def test_push_overwrite_remote(self):
 		"""Push, overwrite remote mismatched content."""
 		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg+b'0')
@@ -264,3 +866,82 @@ class TestSync(pyfakefs.fake_filesystem_unittest.TestCase):
 
 		self.assertEqual(sorted(self.stub_api.uploaded), sorted(['/tmp/filename0.jpg',
 				'/tmp/filename1.jpg']))
+
+	def testPushTree(self):
+		"""Push a tree, each directory is synced with its own album."""
+		self.fs.create_file('/tmp/a/filename0.jpg', contents=small_jpg+b'0')
+		self.fs.create_file('/tmp/b/c/filename1.jpg', contents=small_jpg+b'1')
+		self.fs.create_file('/tmp/.hidden/filename2.jpg', contents=small_jpg+b'2')
+		self.fs.create_file('/tmp/filename3.jpg', contents=small_jpg+b'3')
+
+		config = Config('Trip {dir}', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, tree=True, album_workers=2)
+
+		self.stub_api.stubAddAlbum('Trip a', 123)
+		self.stub_api.stubAddPhoto(123, 'existing.jpg', 'existing', '', small_jpg)
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(sorted(self.stub_api.uploaded), ['/tmp/a/filename0.jpg',
+				'/tmp/b/c/filename1.jpg'])
+		# The existing album was found in the one listing, "b" has no files to upload.
+		self.assertEqual(self.stub_api.photosets.created, ['Trip b/c'])
+		self.assertEqual(self.flickrwrapper.call_counts['photosets.getList'], 1)
+
+	def testPullTree(self):
+		"""Pull a tree, albums matching the template get a directory."""
+		config = Config('Trip {dir}', '/tmp', api_key='apikey', api_secret='apisecret',
+				pull=True, tree=True)
+
+		self.stub_api.stubAddAlbum('Trip x/y', 123)
+		self.stub_api.stubAddPhoto(123, 'filename0.jpg', 'filename0.jpg', '', small_jpg+b'0')
+		self.stub_api.stubAddAlbum('Trip ../escaped', 124)
+		self.stub_api.stubAddPhoto(124, 'filename1.jpg', 'filename1.jpg', '', small_jpg+b'1')
+		self.stub_api.stubAddAlbum('Unrelated', 125)
+
+		sync(config, self.flickrwrapper)
+
+		with open('/tmp/x/y/filename0.jpg', 'rb') as f:
+			self.assertEqual(f.read(), small_jpg+b'0')
+		self.assertEqual(os.listdir('/tmp'), ['x'])
+		self.assertFalse(os.path.exists('/escaped'))
+
+	def testPushSkipsNonImages(self):
+		"""Push sync, non-image files aren't uploaded and photos with their titles are kept."""
+		self.fs.create_file('/tmp/notes.txt', contents=b'not an image')
+		self.fs.create_file('/tmp/photo.dat', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, sync=True)
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'notes.txt', 'notesid', '', b'')
+
+		sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/photo.dat'])
+		self.assertNotIn('photos.delete', self.flickrwrapper.call_counts)
+
+	def testPushChecksumWhileUploading(self):
+		"""Push, a new file's checksum is calculated from the upload's read and tagged after."""
+		self.fs.create_file('/tmp/filename0.jpg', contents=small_jpg)
+
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				checksum=True, push=True, tag='mytag')
+		config.album_id = 123
+
+		self.stub_api.stubAddAlbum(config.album, config.album_id)
+		self.stub_api.stubAddPhoto(config.album_id, 'existing.jpg', 'existing', 'mytag', b'')
+
+		# The file isn't read separately to hash it.
+		with mock.patch.object(LocalPhoto, 'checksum', side_effect=AssertionError):
+			sync(config, self.flickrwrapper)
+
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/filename0.jpg'])
+		self.assertEqual(self.stub_api.photos.added_tags, [('uploaded:/tmp/filename0.jpg',
+				'checksum:md5=8c90748342f19b195b9c6b4eff742ded')])
+		# The checksum is cached like one calculated on its own.
+		cache = LocalCache(config.dir_, '/tmp')
+		self.assertEqual(cache.get('filename0.jpg', os.stat('/tmp/filename0.jpg'), 'md5'),
+				'8c90748342f19b195b9c6b4eff742ded')
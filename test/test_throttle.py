@@ -0,0 +1,126 @@
+import tempfile
+import unittest
+from unittest import mock
+
+# Unexported names for targetted whitebox testing.
+from flickrsyncr.throttle import AdaptiveLimit
+from flickrsyncr.throttle import ThrottledReader
+from flickrsyncr.throttle import TokenBucket
+
+
+class TestTokenBucket(unittest.TestCase):
+	"""Tests for the throttle.TokenBucket class, with a fake clock.
+	"""
+	def setUp(self):
+		self.now = 1000.0
+		self.slept = []
+		def sleep(seconds):
+			self.slept.append(seconds)
+			self.now += seconds
+		patchers = [
+			mock.patch('flickrsyncr.throttle.time.monotonic', lambda: self.now),
+			mock.patch('flickrsyncr.throttle.time.sleep', sleep),
+		]
+		for p in patchers:
+			p.start()
+			self.addCleanup(p.stop)
+
+	def testBurst(self):
+		bucket = TokenBucket(rate=1, capacity=3)
+		for _ in range(3):
+			bucket.acquire()
+		self.assertEqual(self.slept, [])
+
+		# The bucket is empty, the next call waits for a token to refill.
+		bucket.acquire()
+		self.assertEqual(self.slept, [1])
+
+	def testRefill(self):
+		bucket = TokenBucket(rate=2, capacity=2)
+		bucket.acquire(2)
+		self.now += 10  # Refills, but never beyond capacity.
+		bucket.acquire(2)
+		self.assertEqual(self.slept, [])
+		bucket.acquire()
+		self.assertEqual(self.slept, [0.5])
+
+	def testLargeAmount(self):
+		bucket = TokenBucket(rate=10, capacity=10)
+		bucket.acquire(30)
+		self.assertEqual(self.slept, [2])
+
+	def testThrottledReader(self):
+		bucket = TokenBucket(rate=10, capacity=10)
+		with tempfile.TemporaryFile() as f:
+			f.write(b'x' * 40)
+			f.seek(0)
+			reader = ThrottledReader(f, bucket)
+			self.assertEqual(reader.len, 40)
+			self.assertEqual(reader.read(10), b'x' * 10)
+			self.assertEqual(self.slept, [])
+			self.assertEqual(reader.read(), b'x' * 30)
+			self.assertEqual(self.slept, [3])
+			self.assertEqual(reader.read(), b'')
+			self.assertEqual(self.slept, [3])
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+	"""Tests for the throttle.AdaptiveLimit class, with a fake clock.
+	"""
+	def setUp(self):
+		self.now = 1000.0
+		patcher = mock.patch('flickrsyncr.throttle.time.monotonic', lambda: self.now)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def operate(self, limit, seconds, congested=False, size=None):
+		started = limit.acquire()
+		self.now += seconds
+		limit.release(started, congested, size)
+
+	def testGrows(self):
+		limit = AdaptiveLimit(maximum=3)
+		self.assertEqual(limit.limit, 1)
+		self.operate(limit, 1)
+		self.assertEqual(limit.limit, 2)
+		self.operate(limit, 1)
+		self.assertEqual(limit.limit, 2)
+		self.operate(limit, 1)
+		self.assertEqual(limit.limit, 3)
+		# Never beyond the maximum.
+		for _ in range(10):
+			self.operate(limit, 1)
+		self.assertEqual(limit.limit, 3)
+
+	def testSlowDoesntGrow(self):
+		limit = AdaptiveLimit(maximum=3)
+		self.operate(limit, 1)
+		self.operate(limit, 10)
+		self.operate(limit, 10)
+		self.assertEqual(limit.limit, 2)
+
+	def testMixedSizesGrow(self):
+		"""Large files are compared with large files, a fast small one doesn't hold them back."""
+		limit = AdaptiveLimit(maximum=4)
+		self.operate(limit, 0.1, size=100 * 2**10)
+		for _ in range(6):
+			self.operate(limit, 10, size=50 * 2**20)
+		self.assertEqual(limit.limit, 4)
+
+	def testSlowOfSameSizeDoesntGrow(self):
+		limit = AdaptiveLimit(maximum=4)
+		self.operate(limit, 1, size=50 * 2**20)
+		self.operate(limit, 10, size=40 * 2**20)
+		self.operate(limit, 10, size=60 * 2**20)
+		self.assertEqual(limit.limit, 2)
+
+	def testCongestionHalvesOnce(self):
+		limit = AdaptiveLimit(maximum=8, initial=8)
+		started = [limit.acquire() for _ in range(3)]
+		self.now += 1
+		for s in started:
+			limit.release(s, congested=True)
+		self.assertEqual(limit.limit, 4)
+		self.assertEqual(limit.peak, 8)
+		self.operate(limit, 1, congested=True)
+		self.assertEqual(limit.limit, 2)
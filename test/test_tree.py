@@ -0,0 +1,43 @@
+import unittest
+
+import pyfakefs.fake_filesystem_unittest
+
+# Officially exported names.
+from flickrsyncr import Config
+# Unexported names for targetted whitebox testing.
+from flickrsyncr.tree import albumDir
+from flickrsyncr.tree import albumName
+from flickrsyncr.tree import treeAlbums
+
+
+class TestTree(pyfakefs.fake_filesystem_unittest.TestCase):
+	"""Tests for mapping directories to albums in tree mode.
+	"""
+	def setUp(self):
+		self.setUpPyfakefs()
+
+	def testAlbumName(self):
+		self.assertEqual(albumName('Trip: {dir}!', '2020/rome'), 'Trip: 2020/rome!')
+		self.assertEqual(albumDir('Trip: {dir}!', 'Trip: 2020/rome!'), '2020/rome')
+
+	def testAlbumDirOutsideTree(self):
+		self.assertEqual(albumDir('Trip {dir}', 'Other'), None)
+		self.assertEqual(albumDir('Trip {dir}', 'Trip ../etc'), None)
+		self.assertEqual(albumDir('Trip {dir}', 'Trip a//b'), None)
+		self.assertEqual(albumDir('Trip {dir}', 'Trip .hidden'), None)
+
+	def testTreeAlbums(self):
+		self.fs.create_dir('/tmp/a/b')
+		self.fs.create_dir('/tmp/.git/objects')
+		self.fs.create_file('/tmp/c.jpg')
+		# Not followed, it would recurse forever.
+		self.fs.create_symlink('/tmp/a/b/loop', '/tmp')
+		albums = {'{dir}': 1, 'd': 2}
+
+		config = Config('{dir}', '/tmp', push=True, tree=True)
+		self.assertEqual(treeAlbums(config, albums), [('a', '/tmp/a'), ('a/b', '/tmp/a/b')])
+
+		# Pulled albums don't need an existing directory.
+		config = Config('{dir}', '/tmp', pull=True, tree=True)
+		self.assertEqual(treeAlbums(config, albums), [('a', '/tmp/a'), ('a/b', '/tmp/a/b'),
+				('d', '/tmp/d'), ('{dir}', '/tmp/{dir}')])
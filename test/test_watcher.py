@@ -0,0 +1,175 @@
+import hashlib
+from unittest import mock
+
+import pyfakefs.fake_filesystem_unittest
+import requests
+
+# Testing support.
+from test.stub_flickrapi import StubFlickrAPI
+from test.stub_flickrapi import small_jpg
+# Officially exported names.
+from flickrsyncr import Config
+from flickrsyncr import SyncError
+# Unexported names for targetted whitebox testing.
+from flickrsyncr.flickrwrapper import FlickrWrapper
+from flickrsyncr.watcher import PollingChanges
+from flickrsyncr.watcher import Watcher
+
+
+class StubChanges():
+	"""Change source that returns the names queued in self.changed."""
+	def __init__(self):
+		self.changed = set()
+
+	def wait(self, timeout):
+		changed, self.changed = self.changed, set()
+		return changed
+
+
+class TestWatcher(pyfakefs.fake_filesystem_unittest.TestCase):
+	"""Tests for the watcher.Watcher class, with a fake clock.
+	"""
+	def setUp(self):
+		self.setUpPyfakefs()
+		self.stub_api = StubFlickrAPI()
+		self.flickrwrapper = FlickrWrapper(self.stub_api, 'userid')
+		self.flickrwrapper.session = self.stub_api.stubSession()
+		self.stub_api.stubAddAlbum('albumname', 123)
+
+		self.now = 0
+		patcher = mock.patch('flickrsyncr.watcher.time.monotonic', lambda: self.now)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def newWatcher(self, **kwargs):
+		config = Config('albumname', '/tmp', api_key='apikey', api_secret='apisecret',
+				push=True, watch=True, watch_settle=5, watch_reconcile=0, **kwargs)
+		config.album_id = 123
+		self.changes = StubChanges()
+		watcher = Watcher(config, self.flickrwrapper, self.changes)
+		watcher.reconcile()
+		return watcher
+
+	def stepAt(self, now, *changed):
+		self.now = now
+		self.changes.changed.update(changed)
+		self.watcher.step()
+
+	def testPushSettledFiles(self):
+		"""Changed files are uploaded once they stop changing, and only once."""
+		self.stub_api.stubAddPhoto(123, 'existing.jpg', 'existing', '', small_jpg)
+		self.watcher = self.newWatcher()
+		self.fs.create_file('/tmp/existing.jpg', contents=small_jpg)
+		f = self.fs.create_file('/tmp/new.jpg', contents=small_jpg[:10])
+
+		self.stepAt(0, 'new.jpg', 'existing.jpg')
+		# Still being written.
+		f.set_contents(small_jpg)
+		self.stepAt(3, 'new.jpg')
+		self.stepAt(7)
+		self.assertEqual(self.stub_api.uploaded, [])
+
+		self.stepAt(8)
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/new.jpg'])
+		# Pushed files are in the album from then on.
+		self.stepAt(9, 'new.jpg')
+		self.stepAt(20)
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/new.jpg'])
+
+	def testReplaceChanged(self):
+		"""With checksum, files whose content changed replace their photo."""
+		old_checksum = hashlib.md5(small_jpg).hexdigest()
+		self.stub_api.stubAddPhoto(123, 'photo.jpg', 'photoid', 'checksum:md5=' + old_checksum,
+				small_jpg)
+		self.watcher = self.newWatcher(checksum=True)
+
+		self.fs.create_file('/tmp/photo.jpg', contents=small_jpg + b'edited')
+		self.stepAt(0, 'photo.jpg')
+		self.stepAt(5)
+		self.assertEqual(self.stub_api.uploaded, [])
+		self.assertEqual(self.stub_api.replaced, [('/tmp/photo.jpg', 'photoid')])
+
+		# The replaced content is known, an unchanged file isn't replaced again.
+		self.stepAt(6, 'photo.jpg')
+		self.stepAt(11)
+		self.assertEqual(len(self.stub_api.replaced), 1)
+
+	def testReconcile(self):
+		"""A full sync runs every watch_reconcile seconds."""
+		self.stub_api.stubAddPhoto(123, 'existing.jpg', 'existing', '', small_jpg)
+		self.watcher = self.newWatcher()
+		self.watcher.config.watch_reconcile = 60
+		self.fs.create_file('/tmp/missed.jpg', contents=small_jpg)
+
+		self.stepAt(59)
+		self.assertEqual(self.stub_api.uploaded, [])
+		self.stepAt(60)
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/missed.jpg'])
+
+	def testReconcileListsOnce(self):
+		"""The album is listed once per full sync, files it pushed are in the album after."""
+		self.stub_api.stubAddPhoto(123, 'existing.jpg', 'existing', '', small_jpg)
+		self.fs.create_file('/tmp/new.jpg', contents=small_jpg)
+		self.watcher = self.newWatcher()
+		self.assertEqual(self.stub_api.photosets.listed, [123])
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/new.jpg'])
+
+		self.stepAt(0, 'new.jpg', 'existing.jpg')
+		self.stepAt(5)
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/new.jpg'])
+
+	def testFailedReconcile(self):
+		"""A full sync that fails still leaves the album to compare changes with, files already
+		in it aren't uploaded again."""
+		self.stub_api.stubAddPhoto(123, 'existing.jpg', 'existing', '', small_jpg)
+		self.fs.create_file('/tmp/existing.jpg', contents=small_jpg)
+		self.fs.create_file('/tmp/new.jpg', contents=small_jpg)
+		upload = self.stub_api.upload
+		def failingUpload(filename, **kwargs):
+			if filename == '/tmp/new.jpg':
+				raise requests.exceptions.HTTPError('403 Forbidden')
+			return upload(filename, **kwargs)
+
+		with mock.patch.object(self.stub_api, 'upload', failingUpload):
+			self.watcher = self.newWatcher()
+		self.assertEqual(self.stub_api.uploaded, [])
+
+		self.stepAt(0, 'existing.jpg')
+		self.stepAt(5)
+		self.assertEqual(self.stub_api.uploaded, [])
+
+	def testUnlistedAlbum(self):
+		"""Nothing is pushed until the album is listed, the sync is retried until it is."""
+		self.stub_api.stubAddPhoto(123, 'existing.jpg', 'existing', '', small_jpg)
+		with mock.patch('flickrsyncr.watcher.syncPhotos', side_effect=SyncError('down')):
+			with mock.patch('flickrsyncr.watcher.loadRemotePhotos', side_effect=SyncError('down')):
+				self.watcher = self.newWatcher()
+		self.assertIsNone(self.watcher.remote)
+		self.fs.create_file('/tmp/new.jpg', contents=small_jpg)
+
+		self.stepAt(0, 'new.jpg')
+		self.stepAt(5)
+		self.assertEqual(self.stub_api.uploaded, [])
+		self.stepAt(60)
+		self.assertEqual(self.stub_api.uploaded, ['/tmp/new.jpg'])
+
+
+class TestPollingChanges(pyfakefs.fake_filesystem_unittest.TestCase):
+	"""Tests for the watcher.PollingChanges class.
+	"""
+	def setUp(self):
+		self.setUpPyfakefs()
+		patcher = mock.patch('flickrsyncr.watcher.time.sleep')
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def testChanges(self):
+		self.fs.create_file('/tmp/old.jpg', contents=b'old')
+		f = self.fs.create_file('/tmp/changed.jpg', contents=b'old')
+		changes = PollingChanges('/tmp', lambda name: name != 'ignored.jpg')
+
+		self.fs.create_file('/tmp/new.jpg', contents=b'new')
+		self.fs.create_file('/tmp/ignored.jpg', contents=b'new')
+		f.set_contents(b'changed')
+		self.assertEqual(changes.wait(1), {'new.jpg', 'changed.jpg'})
+		self.assertEqual(changes.wait(1), set())